@@ -0,0 +1,229 @@
+import os
+import atexit
+import sqlite3
+import threading
+import time
+from db_pool import get_db
+from rate_limits import record_hits, prune_rate_limits, post_view_key
+from analytics_rollups import apply_rollups
+from analytics_dimensions import user_agent_id, referrer_id, forget_cached_ids
+
+# Page views and share hits are buffered in-process and written in a single
+# transaction, so the post view path never waits on SQLite's write lock.
+FLUSH_INTERVAL_MS = int(os.environ.get('ANALYTICS_FLUSH_INTERVAL_MS', 2000))
+FLUSH_BATCH_SIZE = int(os.environ.get('ANALYTICS_FLUSH_BATCH_SIZE', 200))
+MAX_BUFFERED_EVENTS = int(os.environ.get('ANALYTICS_MAX_BUFFERED_EVENTS', 5000))
+# Past this point producers flush inline instead of waiting for the thread
+BACKPRESSURE_THRESHOLD = MAX_BUFFERED_EVENTS // 2
+
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_wakeup = threading.Event()
+_flush_thread = None
+_inflight = None
+
+_stats = {
+    'enqueued': 0,
+    'flushed': 0,
+    'dropped': 0,
+    'flushes': 0,
+    'flush_errors': 0,
+    'backpressure_flushes': 0,
+    'last_flush_at': None,
+    'last_flush_ms': None,
+}
+
+def _new_batch():
+    return {
+        'pageviews': [],
+        'views': {},
+        'shares': {},
+        'last_seen': {},
+        'user_views': set(),
+        'first_views': [],
+        'ip_views': {},
+        'events': 0,
+    }
+
+_batch = _new_batch()
+
+def _merge_batches(older, newer):
+    # newer's events come after older's, so its last_seen values win
+    merged = _new_batch()
+    for batch in (older, newer):
+        merged['pageviews'].extend(batch['pageviews'])
+        merged['first_views'].extend(batch['first_views'])
+        merged['user_views'].update(batch['user_views'])
+        merged['last_seen'].update(batch['last_seen'])
+        for field in ('views', 'shares', 'ip_views'):
+            for key, count in batch[field].items():
+                merged[field][key] = merged[field].get(key, 0) + count
+        merged['events'] += batch['events']
+    return merged
+
+def _pending_batches():
+    return [b for b in (_batch, _inflight) if b is not None]
+
+def _enqueue(apply):
+    with _lock:
+        pending = sum(b['events'] for b in _pending_batches())
+        if pending >= MAX_BUFFERED_EVENTS:
+            _stats['dropped'] += 1
+            return False
+        apply(_batch)
+        _batch['events'] += 1
+        _stats['enqueued'] += 1
+        size = _batch['events']
+        if size >= BACKPRESSURE_THRESHOLD:
+            _stats['backpressure_flushes'] += 1
+
+    if size >= BACKPRESSURE_THRESHOLD:
+        flush()
+    elif size >= FLUSH_BATCH_SIZE:
+        if _flush_thread is not None and _flush_thread.is_alive():
+            _wakeup.set()
+        else:
+            flush()
+    return True
+
+def record_pageview(slug, user_id, ip_hash, user_agent, referrer, event_type, platform, viewed_at, count_view=False):
+    # count_view: the caller saw no earlier view by this visitor and wants it
+    # counted. It shows up in the pending count straight away; the flush only
+    # keeps it if the user_views insert proves it really was the first.
+    def apply(batch):
+        batch['pageviews'].append((slug, user_id, ip_hash, user_agent, referrer, event_type, platform, viewed_at))
+        if event_type == 'view':
+            counted = count_view and (slug, user_id) not in batch['user_views']
+            batch['user_views'].add((slug, user_id))
+            batch['first_views'].append((slug, user_id, ip_hash, viewed_at, counted))
+            if counted:
+                batch['views'][slug] = batch['views'].get(slug, 0) + 1
+                batch['last_seen'][slug] = viewed_at
+            key = (slug, ip_hash)
+            batch['ip_views'][key] = batch['ip_views'].get(key, 0) + 1
+    return _enqueue(apply)
+
+def record_counter(slug, field, viewed_at):
+    # field is 'views' or 'shares'
+    def apply(batch):
+        batch[field][slug] = batch[field].get(slug, 0) + 1
+        batch['last_seen'][slug] = viewed_at
+    return _enqueue(apply)
+
+def has_pending_view(slug, user_id):
+    with _lock:
+        return any((slug, user_id) in b['user_views'] for b in _pending_batches())
+
+def pending_ip_views(slug, ip_hash):
+    with _lock:
+        return sum(b['ip_views'].get((slug, ip_hash), 0) for b in _pending_batches())
+
+def pending_counter(slug, field):
+    with _lock:
+        return sum(b[field].get(slug, 0) for b in _pending_batches())
+
+def flush():
+    """Write everything buffered so far in one transaction. Returns the number
+    of events written."""
+    global _batch, _inflight
+    with _flush_lock:
+        with _lock:
+            batch = _batch
+            if not batch['events']:
+                return 0
+            _batch = _new_batch()
+            _inflight = batch
+
+        started = time.monotonic()
+        conn = get_db()
+        views = dict(batch['views'])
+        try:
+            conn.executemany('''
+                INSERT INTO analytics_pageviews (slug, user_id, ip_hash, user_agent_id, referrer_id, event_type, platform, viewed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [
+                (slug, user_id, ip_hash, user_agent_id(conn, user_agent), referrer_id(conn, referrer), event_type, platform, viewed_at)
+                for slug, user_id, ip_hash, user_agent, referrer, event_type, platform, viewed_at in batch['pageviews']
+            ])
+            apply_rollups(conn, batch['pageviews'])
+            # The unique (slug, user_id) key settles races between workers:
+            # a view only counts if its row is the one that got inserted
+            for slug, user_id, ip_hash, viewed_at, counted in batch['first_views']:
+                inserted = conn.execute('''
+                    INSERT OR IGNORE INTO user_views (slug, user_id, ip_hash, viewed_at) VALUES (?, ?, ?, ?)
+                ''', (slug, user_id, ip_hash, viewed_at)).rowcount
+                if counted and not inserted:
+                    views[slug] -= 1
+            conn.executemany('''
+                INSERT INTO post_views (slug, view_count, shares_count, last_viewed)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(slug) DO UPDATE SET
+                    view_count = view_count + excluded.view_count,
+                    shares_count = shares_count + excluded.shares_count,
+                    last_viewed = excluded.last_viewed
+            ''', [
+                (slug, views.get(slug, 0), batch['shares'].get(slug, 0), last_seen)
+                for slug, last_seen in batch['last_seen'].items()
+            ])
+            for (slug, ip_hash), count in batch['ip_views'].items():
+                record_hits('post_view', [post_view_key(slug, ip_hash)], amount=count, conn=conn)
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            # Ids interned in this transaction no longer exist
+            forget_cached_ids()
+            # A busy database (another connection holding the write lock past
+            # busy_timeout) is retried on the next flush; the batch still
+            # counts towards MAX_BUFFERED_EVENTS, so new events are what gets
+            # dropped if the lock is held for long
+            retry = isinstance(e, sqlite3.OperationalError) and 'locked' in str(e)
+            with _lock:
+                _stats['flush_errors'] += 1
+                if retry:
+                    _batch = _merge_batches(batch, _batch)
+                else:
+                    _stats['dropped'] += batch['events']
+                _inflight = None
+            print(f"[analytics] Failed to flush {batch['events']} events{', will retry' if retry else ''}: {e}")
+            return 0
+
+        try:
+            prune_rate_limits(conn)
+        except sqlite3.Error as e:
+            print(f"[analytics] Failed to prune rate limit buckets: {e}")
+
+        with _lock:
+            _inflight = None
+            _stats['flushes'] += 1
+            _stats['flushed'] += batch['events']
+            _stats['last_flush_at'] = time.time()
+            _stats['last_flush_ms'] = round((time.monotonic() - started) * 1000, 2)
+        return batch['events']
+
+def get_buffer_stats():
+    with _lock:
+        stats = dict(_stats)
+        stats['buffered'] = sum(b['events'] for b in _pending_batches())
+    stats['max_buffered'] = MAX_BUFFERED_EVENTS
+    stats['flush_interval_ms'] = FLUSH_INTERVAL_MS
+    stats['flush_batch_size'] = FLUSH_BATCH_SIZE
+    return stats
+
+def run_analytics_flush():
+    while True:
+        _wakeup.wait(FLUSH_INTERVAL_MS / 1000)
+        _wakeup.clear()
+        try:
+            flush()
+        except Exception as e:
+            print(f"[analytics] Flush loop error: {e}")
+
+def start_analytics_flush_thread():
+    global _flush_thread
+    if _flush_thread is not None and _flush_thread.is_alive():
+        return
+    _flush_thread = threading.Thread(target=run_analytics_flush, daemon=True)
+    _flush_thread.start()
+
+# Worker shutdown (gunicorn exits workers through sys.exit) drains the buffer
+atexit.register(flush)
@@ -0,0 +1,89 @@
+import re
+import threading
+from urllib.parse import urlparse
+from post_helpers import get_share_platform_from_user_agent
+
+# User agents and referrers are stored once each in user_agents / referrers
+# and analytics_pageviews keeps only their integer ids. A UA is classified
+# (browser, OS, bot) when it is first seen, so reports group by small ids
+# and never re-parse strings.
+
+# First match wins, so more specific engines come before the ones they
+# mimic (Edge and Opera also say Chrome, Chrome also says Safari)
+BROWSERS = [
+    ('edg/', 'Edge'),
+    ('opr/', 'Opera'),
+    ('samsungbrowser', 'Samsung Internet'),
+    ('firefox', 'Firefox'),
+    ('fxios', 'Firefox'),
+    ('crios', 'Chrome'),
+    ('chrome', 'Chrome'),
+    ('safari', 'Safari'),
+]
+OPERATING_SYSTEMS = [
+    ('android', 'Android'),
+    ('iphone', 'iOS'),
+    ('ipad', 'iOS'),
+    ('cros', 'ChromeOS'),
+    ('windows', 'Windows'),
+    ('mac os x', 'macOS'),
+    ('linux', 'Linux'),
+]
+BOT_PATTERN = re.compile(r'bot|crawl|spider|slurp|preview|fetch|curl|wget|python-|go-http|headless|monitor', re.IGNORECASE)
+
+# (table, analytics_pageviews column)
+DIMENSIONS = [('user_agents', 'user_agent_id'), ('referrers', 'referrer_id')]
+
+# Bounded per-process cache of text -> id; the tables are the source of truth
+CACHE_LIMIT = 10000
+
+_lock = threading.Lock()
+_ids = {'user_agents': {}, 'referrers': {}}
+
+def classify_user_agent(user_agent):
+    """(browser, os, is_bot) for a User-Agent string."""
+    lower = user_agent.lower()
+    is_bot = bool(BOT_PATTERN.search(lower) or get_share_platform_from_user_agent(user_agent))
+    browser = next((name for sig, name in BROWSERS if sig in lower), 'Other')
+    os_name = next((name for sig, name in OPERATING_SYSTEMS if sig in lower), 'Other')
+    return ('Bot' if is_bot else browser), os_name, int(is_bot)
+
+def referrer_host(referrer):
+    host = urlparse(referrer).hostname or ''
+    return host[4:] if host.startswith('www.') else host
+
+def _lookup(conn, table, value, insert):
+    if not value:
+        return None
+    with _lock:
+        cached = _ids[table].get(value)
+    if cached is not None:
+        return cached
+    row = conn.execute(f'SELECT id FROM {table} WHERE value = ?', (value,)).fetchone()
+    if row is None:
+        insert()
+        row = conn.execute(f'SELECT id FROM {table} WHERE value = ?', (value,)).fetchone()
+    with _lock:
+        if len(_ids[table]) >= CACHE_LIMIT:
+            _ids[table].clear()
+        _ids[table][value] = row[0]
+    return row[0]
+
+def user_agent_id(conn, user_agent):
+    """Id of user_agent in user_agents, adding and classifying it if new.
+    Runs inside the caller's transaction."""
+    def insert():
+        browser, os_name, is_bot = classify_user_agent(user_agent)
+        conn.execute('INSERT OR IGNORE INTO user_agents (value, browser, os, is_bot) VALUES (?, ?, ?, ?)', (user_agent, browser, os_name, is_bot))
+    return _lookup(conn, 'user_agents', user_agent, insert)
+
+def referrer_id(conn, referrer):
+    def insert():
+        conn.execute('INSERT OR IGNORE INTO referrers (value, host) VALUES (?, ?)', (referrer, referrer_host(referrer)))
+    return _lookup(conn, 'referrers', referrer, insert)
+
+def forget_cached_ids():
+    # For when the dictionary tables are rewritten underneath us (rollbacks)
+    with _lock:
+        for ids in _ids.values():
+            ids.clear()
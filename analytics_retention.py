@@ -0,0 +1,149 @@
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from extensions import DB_PATH
+from db_pool import get_db
+from analytics_dimensions import DIMENSIONS
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Raw pageviews older than the retention window are moved out of the hot
+# table into one SQLite file per month (analytics_archive/pageviews-YYYY-MM.db)
+# and the freed pages are handed back with incremental vacuum. Dashboards
+# read the daily rollups, which are kept forever, and the rate limiter only
+# looks back 30 days, so nothing on the request path needs the old rows.
+RETENTION_DAYS = int(os.environ.get('ANALYTICS_RETENTION_DAYS', 180))
+ARCHIVE_DIR = os.environ.get('ANALYTICS_ARCHIVE_DIR', os.path.join(os.path.dirname(DB_PATH), 'analytics_archive'))
+# Rows moved per write transaction, so buffer flushes never wait long
+BATCH_SIZE = 5000
+RUN_INTERVAL = 24 * 60 * 60
+
+def archive_path(month):
+    return os.path.join(ARCHIVE_DIR, f'pageviews-{month}.db')
+
+def _columns(conn, schema, table='analytics_pageviews'):
+    return [row[1] for row in conn.execute(f'PRAGMA {schema}.table_info({table})')]
+
+def _prepare_archive(conn):
+    # Mirror the hot tables' columns (including any added since the archive
+    # file was created); the unique ids make re-running a batch harmless.
+    # The user agent / referrer dictionaries come along so each file stands
+    # on its own.
+    for table in ['analytics_pageviews'] + [table for table, _ in DIMENSIONS]:
+        if not _columns(conn, 'archive', table):
+            conn.execute(f'CREATE TABLE archive.{table} AS SELECT * FROM main.{table} WHERE 0')
+            conn.execute(f'CREATE UNIQUE INDEX archive.idx_archive_{table}_id ON {table}(id)')
+        existing = set(_columns(conn, 'archive', table))
+        for column in _columns(conn, 'main', table):
+            if column not in existing:
+                conn.execute(f'ALTER TABLE archive.{table} ADD COLUMN {column}')
+
+def _archive_month(conn, month, first_id, last_id, cutoff):
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    conn.execute('ATTACH DATABASE ? AS archive', (archive_path(month),))
+    try:
+        _prepare_archive(conn)
+        columns = ', '.join(_columns(conn, 'main'))
+        where = 'id BETWEEN ? AND ? AND viewed_at < ? AND substr(viewed_at, 1, 7) = ?'
+        params = (first_id, last_id, cutoff, month)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(f'INSERT OR IGNORE INTO archive.analytics_pageviews ({columns}) SELECT {columns} FROM main.analytics_pageviews WHERE {where}', params)
+            for table, column in DIMENSIONS:
+                table_columns = ', '.join(_columns(conn, 'main', table))
+                conn.execute(f'''
+                    INSERT OR IGNORE INTO archive.{table} ({table_columns}) SELECT {table_columns} FROM main.{table}
+                    WHERE id IN (SELECT {column} FROM main.analytics_pageviews WHERE {where})
+                ''', params)
+            moved = conn.execute(f'DELETE FROM main.analytics_pageviews WHERE {where}', params).rowcount
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+    finally:
+        conn.execute('DETACH DATABASE archive')
+    return moved
+
+def archive_old_pageviews(conn=None, retention_days=RETENTION_DAYS):
+    """Move raw pageviews older than retention_days into the monthly archive
+    files. Returns the number of rows moved."""
+    conn = conn or get_db()
+    cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat()
+    moved = 0
+    last_id = 0
+    while True:
+        # Walk by id (insertion order) rather than scanning on viewed_at
+        rows = conn.execute('SELECT id, viewed_at FROM analytics_pageviews WHERE id > ? ORDER BY id LIMIT ?', (last_id, BATCH_SIZE)).fetchall()
+        months = sorted({viewed_at[:7] for _, viewed_at in rows if viewed_at < cutoff})
+        if not months:
+            break
+        for month in months:
+            moved += _archive_month(conn, month, rows[0][0], rows[-1][0], cutoff)
+        last_id = rows[-1][0]
+    return moved
+
+def reclaim_space(conn=None):
+    """Release free pages (incremental auto_vacuum databases only) and
+    truncate the WAL."""
+    conn = conn or get_db()
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        conn.execute('PRAGMA incremental_vacuum')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+def enable_incremental_vacuum(conn=None):
+    # Databases created before auto_vacuum was set need one full VACUUM to
+    # switch; it locks the database while it runs, so this is CLI-only
+    conn = conn or get_db()
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+
+def run_retention():
+    moved = archive_old_pageviews()
+    reclaim_space()
+    return moved
+
+def run_retention_loop():
+    lock_file_path = os.path.join(tempfile.gettempdir(), 'analytics_retention.lock')
+    try:
+        f = open(lock_file_path, 'w')
+    except IOError:
+        return
+
+    while True:
+        try:
+            if fcntl:
+                fcntl.lockf(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                import msvcrt
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+
+            try:
+                moved = run_retention()
+                if moved:
+                    print(f"[analytics] Archived {moved} pageviews older than {RETENTION_DAYS} days")
+            except Exception as e:
+                print(f"Error in analytics retention job: {e}")
+            time.sleep(RUN_INTERVAL)
+        except IOError:
+            time.sleep(60)
+        except Exception as e:
+            print(f"Unexpected analytics retention error: {e}")
+            time.sleep(60)
+
+def start_analytics_retention_thread():
+    thread = threading.Thread(target=run_retention_loop, daemon=True)
+    thread.start()
+
+if __name__ == '__main__':
+    if '--vacuum' in sys.argv:
+        enable_incremental_vacuum()
+    moved = run_retention()
+    print(f"[analytics] {moved} pageviews archived into {ARCHIVE_DIR}/")
@@ -0,0 +1,65 @@
+import os
+import re
+import hashlib
+import threading
+
+# Templates link to content-hashed URLs (/style.<hash>.css,
+# /static/js/common.<hash>.js) so browsers and Cloudflare can keep them
+# forever; editing a file changes its URL instead of waiting for caches to
+# expire. Hashes are cached per file until its mtime/size changes.
+FINGERPRINT_LENGTH = 10
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+# Unversioned URLs (post images, the plain /style.css) are cached for this
+# long and then revalidated with their ETag
+ASSET_MAX_AGE = int(os.environ.get('ASSET_MAX_AGE', 24 * 60 * 60))
+
+_FINGERPRINT_RE = re.compile(r'^(.+)\.([0-9a-f]{%d})(\.[^./]+)$' % FINGERPRINT_LENGTH)
+
+_lock = threading.Lock()
+_hashes = {}
+
+def content_hash(path):
+    """SHA-256 of a file's contents, re-hashed only when its mtime/size change."""
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    key = os.path.normpath(path)
+    with _lock:
+        memo = _hashes.get(key)
+    if memo and memo[0] == stamp:
+        return memo[1]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    digest = digest.hexdigest()
+    with _lock:
+        _hashes[key] = (stamp, digest)
+    return digest
+
+def _local_path(url):
+    if url == '/style.css':
+        return 'style.css'
+    if url.startswith('/static/'):
+        return os.path.join('static', url[len('/static/'):])
+    return None
+
+def asset_url(url):
+    """Fingerprinted form of a /style.css or /static/ URL. Anything else, or a
+    file that doesn't exist, is returned unchanged."""
+    path = _local_path(url)
+    if path is None:
+        return url
+    try:
+        digest = content_hash(path)
+    except OSError:
+        return url
+    root, ext = os.path.splitext(url)
+    return f'{root}.{digest[:FINGERPRINT_LENGTH]}{ext}'
+
+def split_fingerprint(filename):
+    """'js/common.0123abcdef.js' -> ('js/common.js', '0123abcdef'), or
+    (filename, None) when the name carries no fingerprint."""
+    match = _FINGERPRINT_RE.match(filename)
+    if not match:
+        return filename, None
+    return match.group(1) + match.group(3), match.group(2)
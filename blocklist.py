@@ -0,0 +1,346 @@
+import os
+import time
+import sqlite3
+import ipaddress
+import threading
+from collections import OrderedDict
+from db_pool import get_db
+
+# Every request passes check_suspicious_block, so the block check is answered
+# from memory: each worker loads blocked_ips once and then replays
+# blocklist_changes, a short log that triggers on blocked_ips append to.
+# Other workers' blocks show up within REFRESH_INTERVAL; a worker that
+# writes to blocked_ips refreshes straight after committing.
+#
+# Past MAX_ENTRIES only the newest rows are kept in memory. Misses then fall
+# back to an indexed lookup, and known-good addresses are remembered in a
+# small negative cache so regular visitors don't repeat it.
+MAX_ENTRIES = int(os.environ.get('BLOCKLIST_MAX_ENTRIES', 200000))
+REFRESH_INTERVAL = float(os.environ.get('BLOCKLIST_REFRESH_INTERVAL', 2))
+NEGATIVE_CACHE_SIZE = 50000
+NEGATIVE_CACHE_TTL = 300
+# Rows kept in blocklist_changes (by migration 7's prune trigger); a worker
+# further behind than this reloads
+CHANGE_LOG_SIZE = 10000
+
+# Range blocks (blocked_ranges) are held in a binary prefix trie per IP
+# version and matched longest-prefix first. Once PROMOTE_THRESHOLD addresses
+# in one /24 (IPv4) or /64 (IPv6) are blocked, the whole network is. That is
+# off unless BLOCKLIST_PROMOTE_THRESHOLD is set, and never covers non-global
+# space or BLOCKLIST_PROMOTE_PROTECTED (comma-separated CIDRs: trusted
+# proxies, admin networks), since one misattributed proxy or carrier NAT
+# address would otherwise block everyone behind it.
+PROMOTE_THRESHOLD = int(os.environ.get('BLOCKLIST_PROMOTE_THRESHOLD', 0))
+PROMOTE_PREFIX = {4: 24, 6: 64}
+PROMOTE_PROTECTED = [ipaddress.ip_network(cidr.strip(), strict=False)
+                     for cidr in os.environ.get('BLOCKLIST_PROMOTE_PROTECTED', '').split(',') if cidr.strip()]
+# Broadest ranges an admin may block, so a typo like /1 (or 0.0.0.0/0) can't
+# lock everyone out, the admin included
+MIN_RANGE_PREFIX = {
+    4: int(os.environ.get('BLOCKLIST_MIN_PREFIX_V4', 8)),
+    6: int(os.environ.get('BLOCKLIST_MIN_PREFIX_V6', 32)),
+}
+# Offline ASN database for ASN blocks: iptoasn.com's ip2asn-combined.tsv
+# (range_start, range_end, AS number, country, description per line)
+ASN_DB_PATH = os.environ.get('ASN_DB_PATH', 'ip2asn-combined.tsv')
+
+_lock = threading.Lock()
+# ip -> id of its latest honeypot row (streamed to on /wp-admin-login), or None
+_ips = {}
+# tracking_id (wpadm_session cookie) -> blocked_ips id
+_tracking = {}
+_negative = OrderedDict()
+_tries = {4: {}, 6: {}}
+# promotion network -> number of blocked addresses in it
+_neighbors = {}
+_state = {'loaded': False, 'complete': True, 'seq': 0, 'checked_at': 0}
+
+# Honeypot fingerprint fields kept in their own blocked_ips columns (the full
+# payload stays in extra_info) so analysis queries are index lookups
+FINGERPRINT_COLUMNS = ('fingerprint_hash', 'screen_res', 'timezone', 'platform', 'webgl_renderer')
+
+def fingerprint_fields(client_fp):
+    """FINGERPRINT_COLUMNS values from a honeypot client fingerprint dict."""
+    if not isinstance(client_fp, dict):
+        return dict.fromkeys(FINGERPRINT_COLUMNS)
+    webgl = client_fp.get('webgl_fp') if isinstance(client_fp.get('webgl_fp'), dict) else {}
+    width, height = client_fp.get('screen_width'), client_fp.get('screen_height')
+    fields = {
+        'fingerprint_hash': client_fp.get('fingerprint_hash'),
+        'screen_res': f"{width or '?'}x{height or '?'}" if width or height else None,
+        'timezone': client_fp.get('timezone'),
+        'platform': client_fp.get('platform'),
+        'webgl_renderer': client_fp.get('webgl_renderer') or webgl.get('renderer'),
+    }
+    return {key: str(value) if value else None for key, value in fields.items()}
+
+def _latest_seq(conn):
+    return conn.execute('SELECT COALESCE(MAX(seq), 0) FROM blocklist_changes').fetchone()[0]
+
+def _honeypot_id(rows):
+    ids = [row[0] for row in rows if row[1] and 'Honeypot' in row[1]]
+    return max(ids) if ids else None
+
+def _promotion_network(ip):
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    return str(ipaddress.ip_network(f'{address}/{PROMOTE_PREFIX[address.version]}', strict=False))
+
+def _count_neighbor(ip, delta):
+    # Caller holds _lock
+    network = _promotion_network(ip)
+    if network:
+        _neighbors[network] = _neighbors.get(network, 0) + delta
+        if _neighbors[network] <= 0:
+            del _neighbors[network]
+
+def _trie_insert(root, network, value):
+    node = root
+    bits = int(network.network_address)
+    width = network.max_prefixlen
+    for i in range(network.prefixlen):
+        node = node.setdefault((bits >> (width - 1 - i)) & 1, {})
+    node['range'] = value
+
+def _trie_match(root, address):
+    node = root
+    match = node.get('range')
+    bits = int(address)
+    width = address.max_prefixlen
+    for i in range(width):
+        node = node.get((bits >> (width - 1 - i)) & 1)
+        if node is None:
+            break
+        match = node.get('range', match)
+    return match
+
+def load_ranges(conn=None):
+    conn = conn or get_db()
+    tries = {4: {}, 6: {}}
+    for row in conn.execute('SELECT id, cidr FROM blocked_ranges'):
+        try:
+            network = ipaddress.ip_network(row['cidr'], strict=False)
+        except ValueError:
+            continue
+        _trie_insert(tries[network.version], network, {'id': row['id'], 'cidr': row['cidr']})
+    with _lock:
+        _tries.update(tries)
+
+def blocked_range(ip):
+    """The most specific blocked range containing ip ({'id', 'cidr'}), or None."""
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    return _trie_match(_tries[address.version], address)
+
+def load_blocklist(conn=None):
+    """(Re)load the in-memory blocklist from blocked_ips."""
+    conn = conn or get_db()
+    seq = _latest_seq(conn)
+    rows = conn.execute('SELECT id, reason, ip_address, tracking_id FROM blocked_ips ORDER BY id DESC LIMIT ?', (MAX_ENTRIES + 1,)).fetchall()
+    complete = len(rows) <= MAX_ENTRIES
+    ips, tracking = {}, {}
+    for row in rows[:MAX_ENTRIES]:
+        honeypot_id = _honeypot_id([row])
+        if ips.get(row['ip_address']) is None:
+            ips[row['ip_address']] = honeypot_id
+        if row['tracking_id']:
+            tracking.setdefault(row['tracking_id'], row['id'])
+    neighbors = {}
+    for ip in ips:
+        network = _promotion_network(ip)
+        if network:
+            neighbors[network] = neighbors.get(network, 0) + 1
+    load_ranges(conn)
+    with _lock:
+        _ips.clear()
+        _ips.update(ips)
+        _tracking.clear()
+        _tracking.update(tracking)
+        _neighbors.clear()
+        _neighbors.update(neighbors)
+        _negative.clear()
+        _state.update(loaded=True, complete=complete, seq=seq, checked_at=time.monotonic())
+
+def _reload_ip(conn, ip):
+    rows = conn.execute('SELECT id, reason FROM blocked_ips WHERE ip_address = ?', (ip,)).fetchall()
+    with _lock:
+        _negative.pop(ip, None)
+        if rows:
+            if ip not in _ips:
+                _count_neighbor(ip, 1)
+            _ips[ip] = _honeypot_id(rows)
+        elif ip in _ips:
+            _count_neighbor(ip, -1)
+            del _ips[ip]
+
+def _reload_tracking_id(conn, tracking_id):
+    row = conn.execute('SELECT id FROM blocked_ips WHERE tracking_id = ? ORDER BY id LIMIT 1', (tracking_id,)).fetchone()
+    with _lock:
+        _negative.pop(('tracking', tracking_id), None)
+        if row:
+            _tracking[tracking_id] = row[0]
+        else:
+            _tracking.pop(tracking_id, None)
+
+def refresh_blocklist(force=False):
+    """Apply changes other workers made since the last refresh. Cheap when
+    nothing changed: one primary key read of the change log, at most every
+    REFRESH_INTERVAL seconds."""
+    now = time.monotonic()
+    if not force and _state['loaded'] and now - _state['checked_at'] < REFRESH_INTERVAL:
+        return
+    conn = get_db()
+    with _lock:
+        _state['checked_at'] = now
+    if not _state['loaded']:
+        load_blocklist(conn)
+        return
+
+    seq = _state['seq']
+    changes = conn.execute('SELECT seq, ip_address, tracking_id, cidr FROM blocklist_changes WHERE seq > ? ORDER BY seq', (seq,)).fetchall()
+    if not changes:
+        return
+    if changes[0]['seq'] > seq + 1:
+        # Older entries were pruned before this worker saw them
+        load_blocklist(conn)
+        return
+    for ip in {row['ip_address'] for row in changes if row['ip_address']}:
+        _reload_ip(conn, ip)
+    for tracking_id in {row['tracking_id'] for row in changes if row['tracking_id']}:
+        _reload_tracking_id(conn, tracking_id)
+    if any(row['cidr'] for row in changes):
+        load_ranges(conn)
+    with _lock:
+        _state['seq'] = changes[-1]['seq']
+
+def _negative_hit(key):
+    with _lock:
+        expires = _negative.get(key)
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            del _negative[key]
+            return False
+        _negative.move_to_end(key)
+        return True
+
+def _remember_negative(key):
+    with _lock:
+        _negative[key] = time.monotonic() + NEGATIVE_CACHE_TTL
+        _negative.move_to_end(key)
+        while len(_negative) > NEGATIVE_CACHE_SIZE:
+            _negative.popitem(last=False)
+
+def _lookup_tracking_id(tracking_id):
+    if tracking_id in _tracking:
+        return _tracking[tracking_id]
+    if _state['complete'] or _negative_hit(('tracking', tracking_id)):
+        return None
+    _reload_tracking_id(get_db(), tracking_id)
+    if tracking_id not in _tracking:
+        _remember_negative(('tracking', tracking_id))
+    return _tracking.get(tracking_id)
+
+def _lookup_ip(ip):
+    if ip in _ips or blocked_range(ip):
+        return True
+    if _state['complete'] or _negative_hit(ip):
+        return False
+    _reload_ip(get_db(), ip)
+    if ip not in _ips:
+        _remember_negative(ip)
+        return False
+    return True
+
+def check_blocked(ip, tracking_id=None):
+    """(is_blocked, db_id). db_id is the row to tarpit on /wp-admin-login: the
+    row the tracking cookie belongs to, else the IP's latest honeypot row."""
+    try:
+        refresh_blocklist()
+    except sqlite3.Error as e:
+        # Keep answering from what is already loaded
+        print(f"[blocklist] Refresh failed: {e}")
+    if tracking_id:
+        db_id = _lookup_tracking_id(tracking_id)
+        if db_id is not None:
+            return True, db_id
+    if _lookup_ip(ip):
+        return True, _ips.get(ip)
+    return False, None
+
+def note_blocked(ip):
+    """Block ip in this worker straight away, e.g. before the row is written.
+    Writers call refresh_blocklist(force=True) after committing, which also
+    picks up unblocks and tracking ids from the change log."""
+    with _lock:
+        _negative.pop(ip, None)
+        if ip not in _ips:
+            _count_neighbor(ip, 1)
+            _ips[ip] = None
+
+def add_range(conn, cidr, reason, source='manual', asn=None):
+    """Insert a range block (normalised, duplicates ignored) on the caller's
+    connection and return its CIDR. The caller commits and then refreshes.
+    Raises ValueError for an invalid CIDR."""
+    cidr = str(ipaddress.ip_network(cidr, strict=False))
+    conn.execute('INSERT OR IGNORE INTO blocked_ranges (cidr, asn, reason, source) VALUES (?, ?, ?, ?)', (cidr, asn, reason, source))
+    return cidr
+
+def check_range(cidr, protected_ips=()):
+    """Normalised CIDR for an admin range block. Raises ValueError if it is
+    invalid, broader than MIN_RANGE_PREFIX, or contains a protected address."""
+    try:
+        if not isinstance(cidr, str):
+            raise TypeError
+        network = ipaddress.ip_network(cidr, strict=False)
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid CIDR: {cidr}')
+    if network.prefixlen < MIN_RANGE_PREFIX[network.version]:
+        raise ValueError(f'{network} is broader than /{MIN_RANGE_PREFIX[network.version]}')
+    for ip in protected_ips:
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            continue
+        if address in network:
+            raise ValueError(f'{network} contains your own address ({ip})')
+    return str(network)
+
+def asn_networks(asn, path=ASN_DB_PATH):
+    """CIDRs announced by an AS according to the offline ASN database."""
+    networks = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 3 or fields[2] != str(asn):
+                continue
+            start, end = ipaddress.ip_address(fields[0]), ipaddress.ip_address(fields[1])
+            networks.extend(str(network) for network in ipaddress.summarize_address_range(start, end))
+    return networks
+
+def _promotable(network):
+    network = ipaddress.ip_network(network)
+    # is_global is False for private, loopback, link-local, reserved and
+    # shared (100.64.0.0/10 carrier NAT) space
+    if not network.is_global:
+        return False
+    return not any(network.overlaps(protected) for protected in PROMOTE_PROTECTED)
+
+def promote_range(ip):
+    """Block ip's whole /24 (or /64) once enough of its neighbors have been
+    blocked individually. Returns the new range's CIDR, or None."""
+    if PROMOTE_THRESHOLD <= 0:
+        return None
+    network = _promotion_network(ip)
+    if not network or _neighbors.get(network, 0) < PROMOTE_THRESHOLD or not _promotable(network) or blocked_range(ip):
+        return None
+    conn = get_db()
+    add_range(conn, network, f'Auto: {_neighbors[network]} blocked addresses in range', source='auto')
+    conn.commit()
+    refresh_blocklist(force=True)
+    print(f"[blocklist] Promoted {network} to a range block")
+    return network
@@ -0,0 +1,64 @@
+import os
+import sqlite3
+import threading
+from extensions import DB_PATH
+
+# Applied once per connection when it is opened. journal_mode is persistent in
+# the database file, the rest are per-connection settings. auto_vacuum only
+# takes effect on a brand new database (see analytics_retention.py --vacuum).
+CONNECTION_PRAGMAS = (
+    'PRAGMA auto_vacuum=INCREMENTAL;',
+    'PRAGMA journal_mode=WAL;',
+    'PRAGMA synchronous=NORMAL;',
+    'PRAGMA busy_timeout=5000;',
+    'PRAGMA cache_size=-16000;',  # negative = KiB, so ~16 MB of page cache
+    'PRAGMA mmap_size=268435456;',  # 256 MB
+    'PRAGMA temp_store=MEMORY;',
+)
+
+_local = threading.local()
+
+def _open_connection():
+    db_dir = os.path.dirname(DB_PATH)
+    if db_dir:
+        os.makedirs(db_dir, exist_ok=True)
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def get_db():
+    """Return this thread's SQLite connection, opening it on first use.
+
+    Each thread (gunicorn worker thread, wasteof sync thread, ...) keeps one
+    connection for its lifetime instead of connecting per query. The pid check
+    makes sure a connection inherited across fork() is never reused.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pid == os.getpid():
+        return conn
+    conn = _open_connection()
+    _local.conn = conn
+    _local.pid = os.getpid()
+    return conn
+
+def release_db(exc=None):
+    """Teardown hook: the connection stays open for the next request, but any
+    transaction left behind by an error is rolled back so it can't leak into
+    it (or hold the write lock)."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pid == os.getpid() and conn.in_transaction:
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            close_db()
+
+def close_db():
+    conn = getattr(_local, 'conn', None)
+    _local.conn = None
+    if conn is not None:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
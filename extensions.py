@@ -1,5 +1,9 @@
 import os
 import hashlib
+import struct
+import threading
+from collections import OrderedDict
+from time import time
 from zoneinfo import ZoneInfo
 from dotenv import load_dotenv
 from authlib.integrations.flask_client import OAuth
@@ -16,6 +20,9 @@ MAX_IMAGE_WIDTH = 1200
 PHOENIX_TZ = ZoneInfo('America/Phoenix')
 
 CACHE_TIMEOUT = 60 * 60
+CACHE_MEMORY_LIMIT = int(os.environ.get('CACHE_MEMORY_LIMIT_MB', 64)) * 1024 * 1024
+# How long a worker trusts its in-memory copy before re-checking the file
+CACHE_REVALIDATE_SECONDS = float(os.environ.get('CACHE_REVALIDATE_SECONDS', 1))
 is_local = (
     os.environ.get('FLASK_ENV') == 'development' 
     or os.environ.get('FLASK_DEBUG') == '1' 
@@ -23,6 +30,113 @@ is_local = (
 )
 disable_cache = os.environ.get('BLOG_DISABLE_CACHE') == 'true'
 
+class TieredCache(FileSystemCache):
+    """FileSystemCache with a bounded, per-worker LRU in front of it.
+
+    Hot keys are served from memory. Each entry remembers the (mtime, inode)
+    stamp of the cache file it came from; at most every revalidate_interval
+    seconds a hit re-stats that file, so a set/delete/clear from another
+    worker is picked up without reading or unpickling anything. Values are
+    shared between callers, so treat them as read-only.
+    """
+
+    def __init__(self, cache_dir, memory_limit=CACHE_MEMORY_LIMIT, revalidate_interval=CACHE_REVALIDATE_SECONDS, **kwargs):
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._memory_limit = memory_limit
+        self._revalidate_interval = revalidate_interval
+        self._memory_lock = threading.Lock()
+        super().__init__(cache_dir, **kwargs)
+
+    def _stamp(self, key):
+        try:
+            st = os.stat(self._get_filename(key))
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_ino)
+
+    def _forget(self, key):
+        with self._memory_lock:
+            entry = self._memory.pop(key, None)
+            if entry:
+                self._memory_bytes -= entry['size']
+
+    def _remember(self, key, value, expires, size, stamp):
+        # Anything bigger than a quarter of the budget (large images) stays on disk only
+        if stamp is None or size > self._memory_limit // 4:
+            self._forget(key)
+            return
+        with self._memory_lock:
+            old = self._memory.pop(key, None)
+            if old:
+                self._memory_bytes -= old['size']
+            self._memory[key] = {'value': value, 'expires': expires, 'size': size, 'stamp': stamp, 'checked': time()}
+            self._memory_bytes += size
+            while self._memory_bytes > self._memory_limit and self._memory:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted['size']
+
+    def get(self, key):
+        if key == self._fs_count_file:
+            return super().get(key)
+
+        now = time()
+        with self._memory_lock:
+            entry = self._memory.get(key)
+            if entry:
+                self._memory.move_to_end(key)
+        if entry:
+            if entry['expires'] and entry['expires'] < now:
+                self._forget(key)
+            elif now - entry['checked'] < self._revalidate_interval:
+                return entry['value']
+            elif self._stamp(key) == entry['stamp']:
+                entry['checked'] = now
+                return entry['value']
+            else:
+                self._forget(key)
+
+        filename = self._get_filename(key)
+        try:
+            with self._safe_stream_open(filename, 'rb') as f:
+                st = os.fstat(f.fileno())
+                expires = struct.unpack('I', f.read(4))[0]
+                if expires != 0 and expires < now:
+                    return None
+                value = self.serializer.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, struct.error):
+            return super().get(key)
+        self._remember(key, value, expires, st.st_size, (st.st_mtime_ns, st.st_ino))
+        return value
+
+    def set(self, key, value, timeout=None, mgmt_element=False):
+        result = super().set(key, value, timeout, mgmt_element=mgmt_element)
+        if mgmt_element:
+            return result
+        if result:
+            expires = self._normalize_timeout(timeout)
+            stamp = self._stamp(key)
+            try:
+                size = os.path.getsize(self._get_filename(key))
+            except OSError:
+                size = 0
+            self._remember(key, value, expires, size, stamp)
+        else:
+            self._forget(key)
+        return result
+
+    def delete(self, key, mgmt_element=False):
+        self._forget(key)
+        return super().delete(key, mgmt_element=mgmt_element)
+
+    def clear(self):
+        with self._memory_lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+        return super().clear()
+
 if is_local or disable_cache:
     cache = NullCache()
     if is_local:
@@ -30,7 +144,7 @@ if is_local or disable_cache:
     else:
         print("[Extensions] --no-cache detected: Caching is disabled (NullCache).")
 else:
-    cache = FileSystemCache('flask_cache', threshold=500, default_timeout=CACHE_TIMEOUT)
+    cache = TieredCache('flask_cache', threshold=500, default_timeout=CACHE_TIMEOUT)
 
 oauth = OAuth()
 
@@ -73,5 +187,11 @@ def get_client_ip():
     # Fall back to remote_addr, which ProxyFix resolves from the trusted proxy.
     return request.headers.get('CF-Connecting-IP') or request.remote_addr or ''
 
+PRIVACY_COUNTRIES = ['AT', 'BE', 'BG', 'HR', 'CY', 'CZ', 'DK', 'EE', 'FI', 'FR', 'DE', 'GR', 'HU', 'IE', 'IT', 'LV', 'LT', 'LU', 'MT', 'NL', 'PL', 'PT', 'RO', 'SK', 'SI', 'ES', 'SE', 'GB', 'UK']
+
+def is_privacy_region():
+    country = request.headers.get('CF-IPCountry', '').upper()
+    return country in PRIVACY_COUNTRIES or country == 'US' or os.environ.get('FORCE_PRIVACY_BANNER') == 'true'
+
 def hash_ip(ip_address):
     return hashlib.sha256(ip_address.encode()).hexdigest()
\ No newline at end of file
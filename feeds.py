@@ -0,0 +1,91 @@
+import hashlib
+from datetime import datetime, timezone
+from feedgen.feed import FeedGenerator
+from extensions import cache
+from post_helpers import get_all_posts, get_post_by_slug
+from post_index import get_posts_version
+
+BASE_URL = "https://blog.joshattic.us"
+# Built once per post set version and kept as bytes in the shared cache, so
+# crawlers and feed readers mostly get a 304 or a cached body
+FEED_CACHE_TIMEOUT = 24 * 60 * 60
+
+STATIC_PAGES = [
+    {'loc': '/', 'changefreq': 'daily', 'priority': '1.0'},
+    {'loc': '/tags', 'changefreq': 'weekly', 'priority': '0.8'},
+    {'loc': '/search', 'changefreq': 'monthly', 'priority': '0.5'},
+    {'loc': '/privacy', 'changefreq': 'yearly', 'priority': '0.3'},
+    {'loc': '/terms', 'changefreq': 'yearly', 'priority': '0.3'},
+]
+
+def build_sitemap(posts):
+    xml = '<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    
+    for page in STATIC_PAGES:
+        xml += f'  <url>\n    <loc>{BASE_URL}{page["loc"]}</loc>\n    <changefreq>{page["changefreq"]}</changefreq>\n    <priority>{page["priority"]}</priority>\n  </url>\n'
+    
+    for p in posts:
+        xml += f'  <url>\n    <loc>{BASE_URL}/posts/{p["slug"]}</loc>\n    <lastmod>{p["date"]}</lastmod>\n    <changefreq>monthly</changefreq>\n    <priority>0.7</priority>\n  </url>\n'
+    xml += '</urlset>'
+    return xml
+
+def _feed_generator(posts, limit=None):
+    fg = FeedGenerator()
+    fg.id(BASE_URL)
+    fg.title('JoshAtticus Blog')
+    fg.description('Personal blog')
+    fg.author({'name': 'JoshAtticus'})
+    fg.link(href=BASE_URL)
+    fg.language('en')
+    
+    # posts are newest first; entries are added oldest first
+    for p in posts[:limit][::-1]:
+        fe = fg.add_entry()
+        fe.id(f"{BASE_URL}/posts/{p['slug']}")
+        fe.title(p['title'])
+        fe.link(href=f"{BASE_URL}/posts/{p['slug']}")
+        try:
+            published = datetime.strptime(p['date'], '%Y-%m-%d').replace(tzinfo=timezone.utc)
+        except:
+            published = datetime.now(timezone.utc)
+        fe.published(published)
+        fe.updated(published)
+        
+        content = f'<p><img src="{BASE_URL}/{p["image"]}" alt="{p["title"]}"></p>' if p['image'] else ""
+        fe.content(content + get_post_by_slug(p['slug'])['content'], type='html')
+        for tag in p['tags']:
+            fe.category(term=tag)
+    return fg
+
+def build_rss(posts, limit=None):
+    return _feed_generator(posts, limit).rss_str()
+
+def build_atom(posts, limit=None):
+    fg = _feed_generator(posts, limit)
+    fg.link(href=f'{BASE_URL}/feed.atom', rel='self')
+    return fg.atom_str()
+
+BUILDERS = {
+    'sitemap': lambda posts, limit: build_sitemap(posts).encode('utf-8'),
+    'rss': build_rss,
+    'atom': build_atom,
+}
+
+def get_feed(kind, limit=None):
+    """Cached {'body', 'etag', 'last_modified'} for 'sitemap', 'rss' or
+    'atom', optionally limited to the newest `limit` posts."""
+    cache_key = f'feed_{kind}_{limit}_{get_posts_version()}'
+    artifact = cache.get(cache_key)
+    if artifact is not None:
+        return artifact
+
+    body = BUILDERS[kind](get_all_posts(), limit)
+    artifact = {
+        'body': body,
+        'etag': hashlib.sha256(body).hexdigest()[:32],
+        # Stable for as long as this version is cached, since every worker
+        # reads the same entry
+        'last_modified': datetime.now(timezone.utc).replace(microsecond=0),
+    }
+    cache.set(cache_key, artifact, FEED_CACHE_TIMEOUT)
+    return artifact
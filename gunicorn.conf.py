@@ -0,0 +1,42 @@
+import os
+import sys
+import time
+import subprocess
+import threading
+
+# gunicorn loads this file from the working directory. When TARPIT_SPAWN is
+# on (the Docker image sets it), the master also runs tarpit_server.py and
+# restarts it if it dies, so the honeypot tarpit ships with the app instead
+# of needing a second service.
+TARPIT_SPAWN = os.environ.get('TARPIT_SPAWN', '0') == '1'
+TARPIT_RESTART_DELAY = 5
+
+_tarpit = {'process': None, 'stopping': False}
+
+def _supervise_tarpit():
+    while not _tarpit['stopping']:
+        process = subprocess.Popen([sys.executable, 'tarpit_server.py'])
+        _tarpit['process'] = process
+        code = process.wait()
+        if _tarpit['stopping']:
+            break
+        print(f"[tarpit] tarpit_server.py exited ({code}), restarting in {TARPIT_RESTART_DELAY}s")
+        time.sleep(TARPIT_RESTART_DELAY)
+
+def on_starting(server):
+    if not TARPIT_SPAWN:
+        return
+    if not os.environ.get('TARPIT_URL'):
+        print("[tarpit] TARPIT_SPAWN is set but TARPIT_URL isn't; blocked scanners will get a 403 instead")
+    threading.Thread(target=_supervise_tarpit, daemon=True).start()
+
+def on_exit(server):
+    _tarpit['stopping'] = True
+    process = _tarpit['process']
+    if process is not None and process.poll() is None:
+        # SIGTERM lets the tarpit write its last data_sent counts
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
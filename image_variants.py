@@ -0,0 +1,264 @@
+import os
+import io
+import sys
+import glob
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from PIL import Image, features
+from extensions import COMPRESSION_QUALITY, MAX_IMAGE_WIDTH
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Resized copies of post images are rendered once and kept on disk, named by
+# the SHA-256 of the source bytes plus the variant, so requests just stream a
+# file. manifest.json maps each source path to its (mtime, size, sha256); a
+# source is only re-hashed, and its variants only re-rendered, once its mtime
+# or size changes.
+VARIANT_DIR = os.environ.get('IMAGE_VARIANT_DIR', 'image_variants')
+MANIFEST_FILE = 'manifest.json'
+SOURCE_DIRS = ['posts/assets', 'posts/*-assets']
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp')
+# Bump when the encoder settings below change so old variants are not reused
+PIPELINE_VERSION = 1
+
+# Modern formats offered to browsers that accept them (see negotiate_format),
+# best first. Only those this Pillow build can encode are used.
+MODERN_FORMATS = [fmt for fmt in os.environ.get('IMAGE_VARIANT_FORMATS', 'avif,webp').split(',') if fmt and features.check(fmt)]
+MODERN_MIMETYPES = {'avif': 'image/avif', 'webp': 'image/webp'}
+
+# name: (max width, max height or None, quality)
+VARIANTS = {
+    'placeholder': (50, None, 20),
+    'thumbnail': (800, None, 70),
+    'full': (2000, None, 90),
+    'compressed': (MAX_IMAGE_WIDTH, 1600, COMPRESSION_QUALITY),
+}
+
+_lock = threading.Lock()
+_manifest = None
+_manifest_mtime = None
+_memo = {}
+# Variant paths (named by source digest, so an edited source gets new ones)
+# that failed to render; cleared on every background pass so they're retried
+_failed = set()
+
+def _manifest_path():
+    return os.path.join(VARIANT_DIR, MANIFEST_FILE)
+
+def _load_manifest():
+    global _manifest, _manifest_mtime
+    try:
+        mtime = os.stat(_manifest_path()).st_mtime_ns
+    except OSError:
+        mtime = None
+    if _manifest is None or mtime != _manifest_mtime:
+        try:
+            with open(_manifest_path(), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('pipeline_version') != PIPELINE_VERSION:
+                raise ValueError('stale manifest')
+        except (OSError, ValueError):
+            manifest = {'pipeline_version': PIPELINE_VERSION, 'sources': {}}
+        _manifest, _manifest_mtime = manifest, mtime
+    return _manifest
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def source_digest(path):
+    """SHA-256 of a source image, re-hashed only when its mtime/size changed."""
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    key = os.path.normpath(path)
+    with _lock:
+        memo = _memo.get(key)
+        if memo and memo[0] == stamp:
+            return memo[1]
+        entry = _load_manifest()['sources'].get(key)
+    if entry and (entry['mtime_ns'], entry['size']) == stamp:
+        digest = entry['sha256']
+    else:
+        digest = _hash_file(path)
+    with _lock:
+        _memo[key] = (stamp, digest)
+    return digest
+
+def _output_format(path):
+    fmt = path.lower().rsplit('.', 1)[-1]
+    return 'jpeg' if fmt == 'jpg' else fmt
+
+def variant_path(digest, variant, ext):
+    return os.path.join(VARIANT_DIR, digest[:2], f'{digest}-{variant}-v{PIPELINE_VERSION}.{ext}')
+
+def _offered_formats(source):
+    # Modern formats worth converting source to; animated GIFs always stay
+    # GIFs, and nothing after the source's own format is better than it
+    source_fmt = _output_format(source)
+    if source_fmt == 'gif':
+        return []
+    offered = []
+    for fmt in MODERN_FORMATS:
+        if fmt == source_fmt:
+            break
+        offered.append(fmt)
+    return offered
+
+def varies_by_accept(source):
+    """Whether negotiate_format can pick different formats for source."""
+    return bool(_offered_formats(source))
+
+def format_names(source):
+    """?format= values that select a variant of source: each offered modern
+    format, plus the source's own format."""
+    return _offered_formats(source) + [_output_format(source)]
+
+def negotiate_format(source, accept_mimetypes):
+    """Pick the modern format the client accepts with the highest q-value
+    (ties go to MODERN_FORMATS order), or None to keep the source format.
+    Only explicit entries count: */* and image/* don't promise AVIF/WebP
+    support, and q=0 refuses a format."""
+    accepted = {value.lower(): quality for value, quality in accept_mimetypes}
+    best, best_quality = None, 0
+    for fmt in _offered_formats(source):
+        quality = accepted.get(MODERN_MIMETYPES[fmt], 0)
+        if quality > best_quality:
+            best, best_quality = fmt, quality
+    return best
+
+def render_variant(source, variant, fmt=None):
+    max_width, max_height, quality = VARIANTS[variant]
+    img = Image.open(source)
+    ratio = min(max_width / img.width, 1.0)
+    if max_height and img.height > max_height:
+        ratio = min(ratio, max_height / img.height)
+    if ratio < 1.0:
+        img = img.resize((int(img.width * ratio), int(img.height * ratio)), Image.LANCZOS)
+
+    fmt = fmt or _output_format(source)
+    if fmt in MODERN_MIMETYPES and img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'A' in img.mode or 'transparency' in img.info else 'RGB')
+    if variant == 'compressed' and img.width * img.height > 2000000:
+        quality = min(quality, 75)
+    save_kwargs = {'format': fmt, 'optimize': True, 'quality': quality}
+    if fmt == 'jpeg':
+        save_kwargs['subsampling'] = 0
+    output = io.BytesIO()
+    img.save(output, **save_kwargs)
+    return output.getvalue()
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def get_variant(source, variant, fmt=None):
+    """Path of the requested variant of source, optionally re-encoded as fmt
+    ('webp'/'avif'), rendering just that one if it isn't on disk yet. Falls
+    back to the source itself if Pillow can't handle the file."""
+    ext = fmt or source.lower().rsplit('.', 1)[-1]
+    path = variant_path(source_digest(source), variant, ext)
+    if os.path.exists(path):
+        return path
+    if path in _failed:
+        return source
+    try:
+        _write_atomic(path, render_variant(source, variant, fmt))
+    except Exception as e:
+        print(f"Size gen error for {source}: {e}")
+        _failed.add(path)
+        return source
+    return path
+
+def iter_source_images():
+    for source_dir in (d for pattern in SOURCE_DIRS for d in glob.glob(pattern)):
+        for root, _, files in os.walk(source_dir):
+            for name in files:
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.normpath(os.path.join(root, name))
+
+def build_variants(prune=False):
+    """Render every missing variant for every source image and rewrite the
+    manifest. Returns (sources, variants rendered)."""
+    os.makedirs(VARIANT_DIR, exist_ok=True)
+    manifest = {'pipeline_version': PIPELINE_VERSION, 'sources': {}}
+    rendered = 0
+    wanted = set()
+    for source in iter_source_images():
+        st = os.stat(source)
+        digest = source_digest(source)
+        manifest['sources'][source] = {'mtime_ns': st.st_mtime_ns, 'size': st.st_size, 'sha256': digest}
+        source_ext = source.lower().rsplit('.', 1)[-1]
+        formats = [None] + [fmt for fmt in MODERN_FORMATS if _output_format(source) not in ('gif', fmt)]
+        for variant in VARIANTS:
+            for fmt in formats:
+                path = variant_path(digest, variant, fmt or source_ext)
+                wanted.add(os.path.normpath(path))
+                if not os.path.exists(path) and get_variant(source, variant, fmt) == path:
+                    rendered += 1
+
+    data = json.dumps(manifest).encode('utf-8')
+    _write_atomic(_manifest_path(), data)
+
+    if prune:
+        for root, _, files in os.walk(VARIANT_DIR):
+            for name in files:
+                path = os.path.normpath(os.path.join(root, name))
+                if name != MANIFEST_FILE and path not in wanted:
+                    os.remove(path)
+    return len(manifest['sources']), rendered
+
+def run_variant_pipeline():
+    lock_file_path = os.path.join(tempfile.gettempdir(), 'image_variants.lock')
+    try:
+        f = open(lock_file_path, 'w')
+    except IOError:
+        return
+
+    while True:
+        # Every worker, pipeline holder or not, retries failed variants
+        # (e.g. after a Pillow upgrade) instead of skipping them until restart
+        _failed.clear()
+        try:
+            if fcntl:
+                fcntl.lockf(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                import msvcrt
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+
+            try:
+                sources, rendered = build_variants()
+                if rendered:
+                    print(f"[image_variants] Rendered {rendered} variants for {sources} images")
+            except Exception as e:
+                print(f"Error in image variant pipeline: {e}")
+            time.sleep(900)
+        except IOError:
+            time.sleep(60)
+        except Exception as e:
+            print(f"Unexpected image variant error: {e}")
+            time.sleep(60)
+
+def start_image_variant_thread():
+    thread = threading.Thread(target=run_variant_pipeline, daemon=True)
+    thread.start()
+
+if __name__ == '__main__':
+    sources, rendered = build_variants(prune='--prune' in sys.argv)
+    print(f"[image_variants] {rendered} variants rendered for {sources} images into {VARIANT_DIR}/")
@@ -0,0 +1,127 @@
+import os
+import time
+import queue
+import sqlite3
+import threading
+import requests
+from extensions import IPHUB_KEY
+from db_pool import get_db
+
+# IP type classification (IPHub's "block" value: 0 residential, 1 hosting,
+# 2 mixed; -1 unknown) runs on a background thread so trap responses never
+# wait on the API. Results are kept in ip_type_cache for IP_TYPE_CACHE_TTL
+# and copied onto every blocked_ips row for that address. An address that
+# is already queued is not queued again.
+IP_TYPE_CACHE_TTL = int(os.environ.get('IP_TYPE_CACHE_TTL', 30 * 24 * 60 * 60))
+ENRICHMENT_QUEUE_SIZE = int(os.environ.get('IP_ENRICHMENT_QUEUE_SIZE', 1000))
+UNKNOWN = -1
+
+def iphub_lookup(ip):
+    resp = requests.get(f'https://v2.api.iphub.info/ip/{ip}', headers={'X-Key': IPHUB_KEY}, timeout=3)
+    if resp.status_code == 200:
+        return resp.json().get('block', UNKNOWN)
+    return UNKNOWN
+
+def stub_lookup(ip):
+    # Stand-in for local development and tests; never touches the network
+    return int(os.environ.get('IP_TYPE_STUB_VALUE', 0))
+
+PROVIDERS = {'iphub': iphub_lookup, 'stub': stub_lookup}
+
+_provider = PROVIDERS.get(os.environ.get('IP_TYPE_PROVIDER', 'iphub' if IPHUB_KEY else ''))
+_queue = queue.Queue(maxsize=ENRICHMENT_QUEUE_SIZE)
+_lock = threading.Lock()
+_queued = set()
+_thread = None
+_stats = {'queued': 0, 'coalesced': 0, 'dropped': 0, 'cache_hits': 0, 'lookups': 0, 'errors': 0}
+
+def set_provider(provider):
+    """Use provider(ip) -> ip type for lookups (a PROVIDERS name, a callable,
+    or None to disable enrichment)."""
+    global _provider
+    _provider = PROVIDERS[provider] if isinstance(provider, str) else provider
+
+def cached_ip_type(ip, conn=None):
+    conn = conn or get_db()
+    row = conn.execute('SELECT ip_type FROM ip_type_cache WHERE ip = ? AND fetched_at > ?', (ip, time.time() - IP_TYPE_CACHE_TTL)).fetchone()
+    return row[0] if row else None
+
+def get_ip_type(ip):
+    """Cached type for ip, or -1 after queueing a lookup. Never blocks on
+    the provider."""
+    try:
+        ip_type = cached_ip_type(ip)
+    except sqlite3.Error:
+        ip_type = None
+    if ip_type is None:
+        enqueue(ip)
+        return UNKNOWN
+    return ip_type
+
+def enqueue(ip):
+    """Queue ip for classification. Returns False when enrichment is off or
+    the queue is full."""
+    if _provider is None or not ip:
+        return False
+    with _lock:
+        if ip in _queued:
+            _stats['coalesced'] += 1
+            return True
+        try:
+            _queue.put_nowait(ip)
+        except queue.Full:
+            _stats['dropped'] += 1
+            return False
+        _queued.add(ip)
+        _stats['queued'] += 1
+    start_ip_enrichment_thread()
+    return True
+
+def _store(conn, ip, ip_type):
+    conn.execute('INSERT OR REPLACE INTO ip_type_cache (ip, ip_type, fetched_at) VALUES (?, ?, ?)', (ip, ip_type, time.time()))
+    conn.execute('UPDATE blocked_ips SET ip_type = ? WHERE ip_address = ? AND (ip_type IS NULL OR ip_type = ?)', (ip_type, ip, UNKNOWN))
+    conn.commit()
+
+def enrich(ip):
+    """Classify one address now (cache first, then the provider) and record
+    the result. Returns the type."""
+    conn = get_db()
+    ip_type = cached_ip_type(ip, conn)
+    with _lock:
+        _stats['cache_hits' if ip_type is not None else 'lookups'] += 1
+    if ip_type is None:
+        ip_type = _provider(ip) if _provider else UNKNOWN
+        if ip_type is None or ip_type == UNKNOWN:
+            # Failed lookups aren't cached so the next hit retries
+            return UNKNOWN
+    _store(conn, ip, ip_type)
+    return ip_type
+
+def run_ip_enrichment():
+    while True:
+        ip = _queue.get()
+        try:
+            enrich(ip)
+        except Exception as e:
+            with _lock:
+                _stats['errors'] += 1
+            print(f"[ip_enrichment] Lookup for {ip} failed: {e}")
+        finally:
+            with _lock:
+                _queued.discard(ip)
+            _queue.task_done()
+
+def get_enrichment_stats():
+    with _lock:
+        stats = dict(_stats)
+    stats['pending'] = _queue.qsize()
+    stats['provider'] = getattr(_provider, '__name__', None)
+    return stats
+
+def start_ip_enrichment_thread():
+    global _thread
+    with _lock:
+        if _thread is not None and _thread.is_alive():
+            return
+        _thread = threading.Thread(target=run_ip_enrichment, daemon=True)
+        _thread.start()
@@ -0,0 +1,512 @@
+import re
+import json
+import time
+import sqlite3
+from urllib.parse import urlparse
+
+# Schema changes are numbered migrations, each applied exactly once per
+# database and recorded in PRAGMA user_version. Add new steps to the end of
+# MIGRATIONS; never edit one that has shipped. Migrations don't import app
+# modules: any constant or parsing they need is copied in here as it was when
+# the migration shipped, so a fresh install and an upgraded database always
+# end up the same.
+
+def _base_schema(conn):
+    # Everything init_db used to (re)run on every boot. Written to be safe on
+    # databases that already have some or all of it.
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS post_views (
+            slug TEXT PRIMARY KEY,
+            view_count INTEGER DEFAULT 0,
+            shares_count INTEGER DEFAULT 0,
+            last_viewed TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_views (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            slug TEXT NOT NULL,
+            user_id TEXT,
+            ip_hash TEXT,
+            viewed_at TEXT NOT NULL,
+            UNIQUE(slug, user_id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_pageviews (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            slug TEXT NOT NULL,
+            user_id TEXT,
+            ip_hash TEXT,
+            user_agent TEXT,
+            referrer TEXT,
+            event_type TEXT DEFAULT 'view',
+            platform TEXT,
+            viewed_at TEXT NOT NULL
+        )
+    ''')
+    try:
+        cursor.execute('ALTER TABLE analytics_pageviews ADD COLUMN event_type TEXT DEFAULT "view"')
+    except sqlite3.OperationalError:
+        pass
+    try:
+        cursor.execute('ALTER TABLE analytics_pageviews ADD COLUMN platform TEXT')
+    except sqlite3.OperationalError:
+        pass
+        
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS comments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            slug TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            author_name TEXT NOT NULL,
+            comment_text TEXT NOT NULL,
+            parent_id INTEGER,
+            created_at TEXT NOT NULL,
+            ip_hash TEXT NOT NULL,
+            FOREIGN KEY (parent_id) REFERENCES comments (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_views_slug_user ON user_views(slug, user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_views_slug_ip_time ON user_views(slug, ip_hash, viewed_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_comments_slug ON comments(slug, created_at)')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            oauth_provider TEXT NOT NULL,
+            oauth_id TEXT NOT NULL,
+            email TEXT,
+            email_verified BOOLEAN DEFAULT 0,
+            name TEXT,
+            picture TEXT,
+            is_admin BOOLEAN DEFAULT 0,
+            created_at TEXT NOT NULL,
+            UNIQUE(oauth_provider, oauth_id)
+        )
+    ''')
+    try:
+        cursor.execute('ALTER TABLE users ADD COLUMN email_verified BOOLEAN DEFAULT 0')
+    except sqlite3.OperationalError:
+        pass
+    try:
+        cursor.execute('ALTER TABLE users ADD COLUMN is_banned BOOLEAN DEFAULT 0')
+    except sqlite3.OperationalError:
+        pass
+    try:
+        cursor.execute('ALTER TABLE comments ADD COLUMN is_deleted BOOLEAN DEFAULT 0')
+    except sqlite3.OperationalError:
+        pass
+    try:
+        cursor.execute('ALTER TABLE comments ADD COLUMN edited_at TEXT')
+    except sqlite3.OperationalError:
+        pass
+    try:
+        cursor.execute('ALTER TABLE comments ADD COLUMN source TEXT DEFAULT "local"')
+    except sqlite3.OperationalError:
+        pass
+    try:
+        cursor.execute('ALTER TABLE comments ADD COLUMN external_id TEXT')
+    except sqlite3.OperationalError:
+        pass
+    try:
+        cursor.execute('ALTER TABLE comments ADD COLUMN author_avatar_url TEXT')
+    except sqlite3.OperationalError:
+        pass
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS comment_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            comment_id INTEGER NOT NULL,
+            old_text TEXT NOT NULL,
+            edited_at TEXT NOT NULL,
+            FOREIGN KEY (comment_id) REFERENCES comments (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS blocked_ips (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ip_address TEXT NOT NULL,
+            user_agent TEXT,
+            country TEXT,
+            reason TEXT,
+            blocked_until TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    try:
+        cursor.execute('ALTER TABLE blocked_ips ADD COLUMN extra_info TEXT')
+    except sqlite3.OperationalError:
+        pass
+    try:
+        cursor.execute('ALTER TABLE blocked_ips ADD COLUMN data_sent INTEGER DEFAULT 0')
+    except sqlite3.OperationalError:
+        pass
+    try:
+        cursor.execute('ALTER TABLE blocked_ips ADD COLUMN ip_type INTEGER DEFAULT -1')
+    except sqlite3.OperationalError:
+        pass
+    try:
+        cursor.execute('ALTER TABLE blocked_ips ADD COLUMN tracking_id TEXT')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_blocked_ips_tracking_id ON blocked_ips(tracking_id)')
+    except sqlite3.OperationalError:
+        pass
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS blocked_fingerprints (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fingerprint_hash TEXT NOT NULL,
+            reason TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_blocked_fingerprints_hash ON blocked_fingerprints(fingerprint_hash)')
+
+def _backfill_rate_limits(conn):
+    # Seed the counters from existing rows. Windows and bucket sizes are the
+    # ones rate_limits.RATE_LIMITS had when this shipped.
+    now = time.time()
+    # analytics timestamps are naive local time, comment timestamps are UTC
+    conn.execute('''
+        INSERT INTO rate_limit_buckets (scope, key, bucket, count)
+        SELECT 'post_view', slug || ':' || ip_hash, CAST(strftime('%s', viewed_at, 'utc') AS INTEGER) / ?, COUNT(*)
+        FROM analytics_pageviews
+        WHERE event_type = 'view' AND ip_hash IS NOT NULL AND viewed_at > ?
+        GROUP BY 2, 3
+    ''', (24 * 60 * 60, time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(now - 30 * 24 * 60 * 60))))
+    for scope, window, bucket_size, where in [('comment', 60 * 60, 5 * 60, ''), ('reply', 10 * 60, 60, 'AND parent_id IS NOT NULL')]:
+        for prefix, column in (('user:', 'user_id'), ('ip:', 'ip_hash')):
+            conn.execute(f'''
+                INSERT INTO rate_limit_buckets (scope, key, bucket, count)
+                SELECT ?, ? || {column}, CAST(strftime('%s', created_at) AS INTEGER) / ?, COUNT(*)
+                FROM comments
+                WHERE created_at > ? {where}
+                GROUP BY 2, 3
+            ''', (scope, prefix, bucket_size, time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(now - window))))
+
+def _rate_limit_buckets(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rate_limit_buckets'")
+    existed = cursor.fetchone() is not None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+            scope TEXT NOT NULL,
+            key TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (scope, key, bucket)
+        ) WITHOUT ROWID
+    ''')
+    if not existed:
+        _backfill_rate_limits(conn)
+
+def _seed_user_views(conn):
+    # View dedup reads user_views; seed it from the view history
+    conn.execute('''
+        INSERT OR IGNORE INTO user_views (slug, user_id, ip_hash, viewed_at)
+        SELECT slug, user_id, MIN(ip_hash), MIN(viewed_at) FROM analytics_pageviews
+        WHERE event_type = 'view' AND user_id IS NOT NULL
+        GROUP BY slug, user_id
+    ''')
+
+def _query_indexes(conn):
+    # Admin analytics, comment sync and blocklist lookups
+    for statement in (
+        'CREATE INDEX IF NOT EXISTS idx_pageviews_event_time ON analytics_pageviews(event_type, viewed_at, ip_hash)',
+        'CREATE INDEX IF NOT EXISTS idx_pageviews_slug_event_time ON analytics_pageviews(slug, event_type, viewed_at)',
+        'CREATE INDEX IF NOT EXISTS idx_pageviews_ip_hash ON analytics_pageviews(ip_hash)',
+        'CREATE INDEX IF NOT EXISTS idx_comments_user_created ON comments(user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_comments_external_id ON comments(external_id)',
+        'CREATE INDEX IF NOT EXISTS idx_blocked_ips_ip_address ON blocked_ips(ip_address)',
+        'CREATE INDEX IF NOT EXISTS idx_blocked_ips_created ON blocked_ips(created_at)',
+    ):
+        conn.execute(statement)
+
+def _hll_add(sketch, ip_hash):
+    # analytics_rollups.sketch_add with the 2**12 registers it shipped with
+    value = int(ip_hash[:16], 16)
+    index = value >> 52
+    rank = 52 - (value & ((1 << 52) - 1)).bit_length() + 1
+    if rank > sketch[index]:
+        sketch[index] = rank
+
+def _analytics_rollups(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_daily (
+            day TEXT NOT NULL,
+            slug TEXT NOT NULL,
+            event_type TEXT NOT NULL,
+            platform TEXT NOT NULL DEFAULT '',
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, slug, event_type, platform)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_analytics_daily_slug ON analytics_daily(slug, event_type, day)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_daily_uniques (
+            day TEXT NOT NULL,
+            slug TEXT NOT NULL,
+            sketch BLOB NOT NULL,
+            PRIMARY KEY (day, slug)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('DELETE FROM analytics_daily')
+    conn.execute('DELETE FROM analytics_daily_uniques')
+    conn.execute('''
+        INSERT INTO analytics_daily (day, slug, event_type, platform, count)
+        SELECT substr(viewed_at, 1, 10), slug, COALESCE(NULLIF(event_type, ''), 'view'), COALESCE(platform, ''), COUNT(*)
+        FROM analytics_pageviews GROUP BY 1, 2, 3, 4
+    ''')
+    # Whole-blog unique visitor sketches per day and for all time ('all')
+    sketches = {}
+    cursor = conn.execute('''
+        SELECT DISTINCT substr(viewed_at, 1, 10), ip_hash FROM analytics_pageviews
+        WHERE COALESCE(NULLIF(event_type, ''), 'view') = 'view' AND ip_hash != ''
+    ''')
+    for day, ip_hash in cursor:
+        for key in (day, 'all'):
+            _hll_add(sketches.setdefault(key, bytearray(1 << 12)), ip_hash)
+    conn.executemany("INSERT INTO analytics_daily_uniques (day, slug, sketch) VALUES (?, '', ?)", [
+        (day, bytes(sketch)) for day, sketch in sketches.items()
+    ])
+
+# analytics_dimensions' classification as of migration 6
+_UA_BROWSERS = [
+    ('edg/', 'Edge'), ('opr/', 'Opera'), ('samsungbrowser', 'Samsung Internet'), ('firefox', 'Firefox'),
+    ('fxios', 'Firefox'), ('crios', 'Chrome'), ('chrome', 'Chrome'), ('safari', 'Safari'),
+]
+_UA_OPERATING_SYSTEMS = [
+    ('android', 'Android'), ('iphone', 'iOS'), ('ipad', 'iOS'), ('cros', 'ChromeOS'),
+    ('windows', 'Windows'), ('mac os x', 'macOS'), ('linux', 'Linux'),
+]
+_UA_BOT_PATTERN = re.compile(r'bot|crawl|spider|slurp|preview|fetch|curl|wget|python-|go-http|headless|monitor', re.IGNORECASE)
+# post_helpers.get_share_platform_from_user_agent's link preview bots
+_UA_SHARE_BOTS = (
+    'discordbot', 'twitterbot', 'facebookexternalhit', 'facebookbot', 'whatsapp', 'telegrambot',
+    'slackbot', 'linkedinbot', 'pinterestbot', 'redditbot', 'tumblr', 'mastodon', 'skypebot',
+    'slackbot-linkexpanding', 'slack-imgproxy', 'iframely', 'bitlybot', 'embedly', 'snapchat',
+    'instagrambot', 'signal', 'imessage',
+)
+
+def _classify_user_agent(user_agent):
+    lower = user_agent.lower()
+    is_bot = bool(_UA_BOT_PATTERN.search(lower) or any(sig in lower for sig in _UA_SHARE_BOTS))
+    browser = next((name for sig, name in _UA_BROWSERS if sig in lower), 'Other')
+    os_name = next((name for sig, name in _UA_OPERATING_SYSTEMS if sig in lower), 'Other')
+    return ('Bot' if is_bot else browser), os_name, int(is_bot)
+
+def _referrer_host(referrer):
+    host = urlparse(referrer).hostname or ''
+    return host[4:] if host.startswith('www.') else host
+
+def _dictionary_encode_pageviews(conn):
+    # Replace the verbatim user_agent / referrer text on every pageview with
+    # ids into interning tables (see analytics_dimensions)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_agents (
+            id INTEGER PRIMARY KEY,
+            value TEXT NOT NULL UNIQUE,
+            browser TEXT,
+            os TEXT,
+            is_bot INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS referrers (
+            id INTEGER PRIMARY KEY,
+            value TEXT NOT NULL UNIQUE,
+            host TEXT
+        )
+    ''')
+    conn.execute('ALTER TABLE analytics_pageviews ADD COLUMN user_agent_id INTEGER REFERENCES user_agents(id)')
+    conn.execute('ALTER TABLE analytics_pageviews ADD COLUMN referrer_id INTEGER REFERENCES referrers(id)')
+
+    user_agents = conn.execute("SELECT DISTINCT user_agent FROM analytics_pageviews WHERE user_agent != ''").fetchall()
+    conn.executemany('INSERT OR IGNORE INTO user_agents (value, browser, os, is_bot) VALUES (?, ?, ?, ?)', [
+        (row[0],) + _classify_user_agent(row[0]) for row in user_agents
+    ])
+    referrers = conn.execute("SELECT DISTINCT referrer FROM analytics_pageviews WHERE referrer != ''").fetchall()
+    conn.executemany('INSERT OR IGNORE INTO referrers (value, host) VALUES (?, ?)', [
+        (row[0], _referrer_host(row[0])) for row in referrers
+    ])
+    conn.execute('''
+        UPDATE analytics_pageviews SET
+            user_agent_id = (SELECT id FROM user_agents WHERE value = analytics_pageviews.user_agent),
+            referrer_id = (SELECT id FROM referrers WHERE value = analytics_pageviews.referrer)
+    ''')
+    conn.execute('ALTER TABLE analytics_pageviews DROP COLUMN user_agent')
+    conn.execute('ALTER TABLE analytics_pageviews DROP COLUMN referrer')
+
+def _blocklist_changes(conn):
+    # Change log the in-memory blocklist replays (see blocklist.py). data_sent
+    # and ip_type updates don't affect blocking, so they aren't logged.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS blocklist_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            ip_address TEXT,
+            tracking_id TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS blocked_ips_log_insert AFTER INSERT ON blocked_ips BEGIN
+            INSERT INTO blocklist_changes (ip_address, tracking_id) VALUES (NEW.ip_address, NEW.tracking_id);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS blocked_ips_log_update AFTER UPDATE OF ip_address, tracking_id, reason ON blocked_ips BEGIN
+            INSERT INTO blocklist_changes (ip_address, tracking_id) VALUES (OLD.ip_address, OLD.tracking_id);
+            INSERT INTO blocklist_changes (ip_address, tracking_id) VALUES (NEW.ip_address, NEW.tracking_id);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS blocked_ips_log_delete AFTER DELETE ON blocked_ips BEGIN
+            INSERT INTO blocklist_changes (ip_address, tracking_id) VALUES (OLD.ip_address, OLD.tracking_id);
+        END
+    ''')
+    # Keeps the newest 10000 entries (blocklist.CHANGE_LOG_SIZE)
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS blocklist_changes_prune AFTER INSERT ON blocklist_changes BEGIN
+            DELETE FROM blocklist_changes WHERE seq <= NEW.seq - 10000;
+        END
+    ''')
+
+def _blocked_ranges(conn):
+    # CIDR blocks (manual, per-ASN or promoted from neighboring IPs), logged
+    # to blocklist_changes like blocked_ips so workers reload their trie
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS blocked_ranges (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cidr TEXT NOT NULL UNIQUE,
+            asn INTEGER,
+            reason TEXT,
+            source TEXT DEFAULT 'manual',
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_blocked_ranges_asn ON blocked_ranges(asn)')
+    conn.execute('ALTER TABLE blocklist_changes ADD COLUMN cidr TEXT')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS blocked_ranges_log_insert AFTER INSERT ON blocked_ranges BEGIN
+            INSERT INTO blocklist_changes (cidr) VALUES (NEW.cidr);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS blocked_ranges_log_update AFTER UPDATE OF cidr ON blocked_ranges BEGIN
+            INSERT INTO blocklist_changes (cidr) VALUES (NEW.cidr);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS blocked_ranges_log_delete AFTER DELETE ON blocked_ranges BEGIN
+            INSERT INTO blocklist_changes (cidr) VALUES (OLD.cidr);
+        END
+    ''')
+
+_FINGERPRINT_COLUMNS = ('fingerprint_hash', 'screen_res', 'timezone', 'platform', 'webgl_renderer')
+
+def _fingerprint_fields(client_fp):
+    # blocklist.fingerprint_fields as of migration 9
+    if not isinstance(client_fp, dict):
+        return dict.fromkeys(_FINGERPRINT_COLUMNS)
+    webgl = client_fp.get('webgl_fp') if isinstance(client_fp.get('webgl_fp'), dict) else {}
+    width, height = client_fp.get('screen_width'), client_fp.get('screen_height')
+    fields = {
+        'fingerprint_hash': client_fp.get('fingerprint_hash'),
+        'screen_res': f"{width or '?'}x{height or '?'}" if width or height else None,
+        'timezone': client_fp.get('timezone'),
+        'platform': client_fp.get('platform'),
+        'webgl_renderer': client_fp.get('webgl_renderer') or webgl.get('renderer'),
+    }
+    return {key: str(value) if value else None for key, value in fields.items()}
+
+def _fingerprint_columns(conn, batch_size=1000):
+    # Pull the honeypot fingerprint out of extra_info into indexed columns
+    for column in _FINGERPRINT_COLUMNS:
+        conn.execute(f'ALTER TABLE blocked_ips ADD COLUMN {column} TEXT')
+    last_id = 0
+    while True:
+        rows = conn.execute('''
+            SELECT id, extra_info FROM blocked_ips
+            WHERE id > ? AND extra_info LIKE '%client_fingerprint%' ORDER BY id LIMIT ?
+        ''', (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        updates = []
+        for row in rows:
+            try:
+                fields = _fingerprint_fields(json.loads(row[1]).get('client_fingerprint'))
+            except (ValueError, AttributeError):
+                continue
+            updates.append(tuple(fields[column] for column in _FINGERPRINT_COLUMNS) + (row[0],))
+        conn.executemany(f'''
+            UPDATE blocked_ips SET {', '.join(f'{column} = ?' for column in _FINGERPRINT_COLUMNS)} WHERE id = ?
+        ''', updates)
+        last_id = rows[-1][0]
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_blocked_ips_fingerprint ON blocked_ips(fingerprint_hash, created_at)')
+
+def _ip_type_cache(conn):
+    # Lookup cache for ip_enrichment, seeded with types already on file
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ip_type_cache (
+            ip TEXT PRIMARY KEY,
+            ip_type INTEGER NOT NULL,
+            fetched_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        INSERT OR IGNORE INTO ip_type_cache (ip, ip_type, fetched_at)
+        SELECT ip_address, MAX(ip_type), ? FROM blocked_ips WHERE ip_type >= 0 GROUP BY ip_address
+    ''', (time.time(),))
+
+MIGRATIONS = [
+    (1, 'base schema', _base_schema),
+    (2, 'rate limit buckets', _rate_limit_buckets),
+    (3, 'seed user_views', _seed_user_views),
+    (4, 'analytics, comment and blocklist indexes', _query_indexes),
+    (5, 'daily analytics rollups', _analytics_rollups),
+    (6, 'dictionary-encode user agents and referrers', _dictionary_encode_pageviews),
+    (7, 'blocklist change log', _blocklist_changes),
+    (8, 'blocked CIDR ranges', _blocked_ranges),
+    (9, 'blocked_ips fingerprint columns', _fingerprint_columns),
+    (10, 'IP type cache', _ip_type_cache),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+MIGRATION_BUSY_TIMEOUT_MS = 5 * 60 * 1000
+
+def get_schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def run_migrations(conn):
+    """Apply pending migrations in order, each in its own transaction. Safe to
+    call from every worker at boot: BEGIN IMMEDIATE serializes them and the
+    version is re-read under the lock. Returns the versions applied."""
+    if get_schema_version(conn) >= SCHEMA_VERSION:
+        return []
+
+    # Other workers wait for a long backfill instead of failing their boot
+    busy_timeout = conn.execute('PRAGMA busy_timeout').fetchone()[0]
+    conn.execute(f'PRAGMA busy_timeout = {MIGRATION_BUSY_TIMEOUT_MS}')
+    applied = []
+    try:
+        for version, name, migrate in MIGRATIONS:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if get_schema_version(conn) >= version:
+                    conn.rollback()
+                    continue
+                migrate(conn)
+                conn.execute(f'PRAGMA user_version = {version}')
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+            print(f"[migrations] Applied {version}: {name}")
+            applied.append(version)
+
+        if applied:
+            # Fresh statistics so the planner picks up the new indexes
+            conn.execute('ANALYZE')
+            conn.commit()
+    finally:
+        conn.execute(f'PRAGMA busy_timeout = {busy_timeout}')
+    return applied
@@ -0,0 +1,45 @@
+import os
+from datetime import datetime
+from flask import request, session
+from extensions import cache, is_privacy_region
+from post_index import get_posts_version
+
+# Rendered HTML for anonymous GETs of the index, tag and post pages. The key
+# covers everything those pages vary on (path, page number, privacy banner,
+# footer year) plus the post set version, so recompiling posts naturally
+# retires every cached page. Per-request numbers such as view counts are
+# rendered as placeholders and filled in with str.replace on the way out.
+PAGE_CACHE_TIMEOUT = int(os.environ.get('PAGE_CACHE_TIMEOUT', 10 * 60))
+# Query strings a cached page may have; requests with anything else skip the
+# cache. The page number goes into the key as the int the view parsed, and
+# only when it is in range, so ?page=01 or ?page=999999 can't add entries.
+CACHEABLE_ARGS = {'page'}
+
+# Control characters survive autoescaping and never occur in post content
+VIEW_COUNT_PLACEHOLDER = '\x1eview_count\x1e'
+SHARES_COUNT_PLACEHOLDER = '\x1eshares_count\x1e'
+
+def page_cache_key(page=1, total_pages=None):
+    if 'user_id' in session or request.method != 'GET' or not set(request.args) <= CACHEABLE_ARGS:
+        return None
+    if total_pages is not None and not 1 <= page <= total_pages:
+        return None
+    # Page 1 shares the bare path's entry
+    query = f'?page={page}' if page != 1 else ''
+    region = 'privacy' if is_privacy_region() else 'default'
+    return f'page:{get_posts_version()}:{datetime.now().year}:{region}:{request.path}{query}'
+
+def cached_page(render, substitutions=None, page=1, total_pages=None):
+    """HTML for the current request: from the page cache when the visitor is
+    anonymous, otherwise freshly rendered. substitutions maps placeholders
+    that render() put in the page to their values for this request. Paginated
+    views pass the page they rendered and how many there are."""
+    key = page_cache_key(page, total_pages)
+    html = cache.get(key) if key else None
+    if html is None:
+        html = render()
+        if key:
+            cache.set(key, html, timeout=PAGE_CACHE_TIMEOUT)
+    for placeholder, value in (substitutions or {}).items():
+        html = html.replace(placeholder, str(value))
+    return html
@@ -1,13 +1,13 @@
 import os
 import re
 import markdown
-import sqlite3
 import requests
 import threading
 import time
 from datetime import datetime, timezone, timedelta
 from urllib.parse import parse_qs, urlparse
-from extensions import cache, CACHE_TIMEOUT, DB_PATH
+from extensions import cache, CACHE_TIMEOUT
+from db_pool import get_db, release_db
 
 try:
     import fcntl
@@ -252,15 +252,15 @@ def sync_wasteof_comments(post_slug, wasteof_link):
             except:
                 break
         
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cursor = conn.cursor()
         for comment in comments:
             process_wasteof_comment(cursor, post_slug, comment, None)
             if comment.get('hasReplies'):
                 fetch_wasteof_replies(cursor, post_slug, comment['_id'])
         conn.commit()
-        conn.close()
     except Exception as e:
+        release_db()
         print(f"Error syncing comments for {post_slug}: {e}")
 
 def run_wasteof_sync():
@@ -306,54 +306,52 @@ def start_wasteof_sync_thread():
     thread = threading.Thread(target=run_wasteof_sync, daemon=True)
     thread.start()
 
+def compile_post(filename, content):
+    front_matter = parse_front_matter(content)
+    content_without_front_matter = re.sub(r"---\n.*?\n---\n", "", content, flags=re.DOTALL)
+    
+    html_content = markdown.markdown(content_without_front_matter, extensions=MD_EXTENSIONS)
+    html_content = enforce_link_target_blank(html_content)
+    html_content = process_image_comparison(html_content)
+    html_content = process_twitter_embed(html_content)
+    html_content = process_youtube_embed(html_content)
+    
+    first_image, content_without_first_image = extract_and_remove_first_image(html_content)
+    if not first_image:
+        first_image = "assets/default-banner.jpg"
+    
+    if 'summary' in front_matter:
+        summary_text = front_matter['summary']
+    else:
+        summary_text = clean_for_summary(html_content)
+        summary_text = summary_text[:150] + "..." if len(summary_text) > 150 else summary_text
+    
+    post_filename = os.path.splitext(filename)[0] + ".html"
+    return {
+        "title": front_matter.get('title', "Untitled"),
+        "date": front_matter.get('date', datetime.now().strftime("%Y-%m-%d")),
+        "filename": post_filename,
+        "slug": os.path.splitext(filename)[0],
+        "summary": summary_text,
+        "image": first_image,
+        "tags": front_matter.get('tags', []),
+        "content": content_without_first_image,
+        "wasteof_link": front_matter.get('wasteof_link')
+    }
+
 def get_all_posts():
-    posts = cache.get('all_posts')
+    """Metadata (title, date, slug, summary, image, tags, wasteof_link) for
+    every post, newest first. Rendered bodies are deliberately left out so list
+    pages don't pay for them; use get_post_by_slug() for a single full post."""
+    posts = cache.get('post_meta')
     if posts is not None:
         return posts
     
-    posts = []
-    if not os.path.exists("posts"):
-        os.makedirs("posts", exist_ok=True)
-        
-    for filename in os.listdir("posts"):
-        if filename.endswith(".md"):
-            with open(os.path.join("posts", filename), "r", encoding="utf-8") as f:
-                content = f.read()
-            
-            front_matter = parse_front_matter(content)
-            content_without_front_matter = re.sub(r"---\n.*?\n---\n", "", content, flags=re.DOTALL)
-            
-            html_content = markdown.markdown(content_without_front_matter, extensions=MD_EXTENSIONS)
-            html_content = enforce_link_target_blank(html_content)
-            html_content = process_image_comparison(html_content)
-            html_content = process_twitter_embed(html_content)
-            html_content = process_youtube_embed(html_content)
-            
-            first_image, content_without_first_image = extract_and_remove_first_image(html_content)
-            if not first_image:
-                first_image = "assets/default-banner.jpg"
-            
-            if 'summary' in front_matter:
-                summary_text = front_matter['summary']
-            else:
-                summary_text = clean_for_summary(html_content)
-                summary_text = summary_text[:150] + "..." if len(summary_text) > 150 else summary_text
-            
-            post_filename = os.path.splitext(filename)[0] + ".html"
-            posts.append({
-                "title": front_matter.get('title', "Untitled"),
-                "date": front_matter.get('date', datetime.now().strftime("%Y-%m-%d")),
-                "filename": post_filename,
-                "slug": os.path.splitext(filename)[0],
-                "summary": summary_text,
-                "image": first_image,
-                "tags": front_matter.get('tags', []),
-                "content": content_without_first_image,
-                "wasteof_link": front_matter.get('wasteof_link')
-            })
-    
-    posts.sort(key=lambda x: x["date"], reverse=True)
-    cache.set('all_posts', posts, CACHE_TIMEOUT)
+    # Rendering happens in post_index, which only recompiles files whose
+    # content changed since the last build, so a cache miss is cheap.
+    from post_index import get_compiled_posts
+    posts = get_compiled_posts()
+    cache.set('post_meta', posts, CACHE_TIMEOUT)
     return posts
 
 def get_post_by_slug(slug):
@@ -362,9 +360,10 @@ def get_post_by_slug(slug):
     if cached_post is not None:
         return cached_post
     
-    posts = get_all_posts()
-    for post in posts:
-        if post['slug'] == slug:
+    from post_index import read_post_body
+    for meta in get_all_posts():
+        if meta['slug'] == slug:
+            post = {**meta, 'content': read_post_body(slug) or ''}
             cache.set(cache_key, post, CACHE_TIMEOUT)
             return post
     return None
@@ -0,0 +1,160 @@
+import os
+import sys
+import json
+import hashlib
+import tempfile
+import threading
+from post_helpers import compile_post
+
+# Posts are rendered once per content change instead of on every post list
+# cache miss. Metadata lives in <POST_INDEX_DIR>/index.json keyed by source
+# file, each rendered body next to it as <slug>.html. A file is recompiled
+# only when its mtime/size changed *and* its content hash no longer matches.
+#
+# `python post_index.py [--rebuild]` builds it ahead of time (the Docker image
+# does this); workers refresh it incrementally at boot.
+
+POSTS_DIR = 'posts'
+POST_INDEX_DIR = os.environ.get('POST_INDEX_DIR', 'compiled_posts')
+INDEX_FILE = 'index.json'
+# Bump whenever compile_post output changes so stale indexes get rebuilt
+COMPILER_VERSION = 1
+
+_lock = threading.Lock()
+_index = None
+_index_mtime = None
+
+def _index_path():
+    return os.path.join(POST_INDEX_DIR, INDEX_FILE)
+
+def _body_path(slug):
+    return os.path.join(POST_INDEX_DIR, f'{slug}.html')
+
+def _write_atomic(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def _empty_index():
+    return {'compiler_version': COMPILER_VERSION, 'version': None, 'files': {}}
+
+def _read_index():
+    try:
+        with open(_index_path(), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return _empty_index()
+    if index.get('compiler_version') != COMPILER_VERSION:
+        return _empty_index()
+    return index
+
+def _compute_version(files):
+    digest = hashlib.sha256(str(COMPILER_VERSION).encode())
+    for filename in sorted(files):
+        digest.update(f"{filename}:{files[filename]['sha256']}\n".encode())
+    return digest.hexdigest()[:16]
+
+def _load_index():
+    global _index, _index_mtime
+    try:
+        mtime = os.stat(_index_path()).st_mtime_ns
+    except OSError:
+        mtime = None
+    # Another worker may have rebuilt the index since we last looked
+    if _index is None or mtime != _index_mtime:
+        _index = _read_index()
+        _index_mtime = mtime
+    return _index
+
+def refresh_post_index(force=False):
+    """Bring the index in line with posts/*.md, compiling only what changed.
+    Returns the list of filenames that were (re)compiled."""
+    global _index, _index_mtime
+    with _lock:
+        index = _empty_index() if force else _load_index()
+        files = index['files']
+        os.makedirs(POSTS_DIR, exist_ok=True)
+        os.makedirs(POST_INDEX_DIR, exist_ok=True)
+
+        compiled = []
+        changed = False
+        seen = set()
+        for filename in os.listdir(POSTS_DIR):
+            if not filename.endswith('.md'):
+                continue
+            seen.add(filename)
+            path = os.path.join(POSTS_DIR, filename)
+            st = os.stat(path)
+            entry = files.get(filename)
+            if entry and entry['mtime_ns'] == st.st_mtime_ns and entry['size'] == st.st_size and os.path.exists(_body_path(entry['post']['slug'])):
+                continue
+
+            with open(path, 'rb') as f:
+                raw = f.read()
+            sha = hashlib.sha256(raw).hexdigest()
+            if entry and entry['sha256'] == sha and os.path.exists(_body_path(entry['post']['slug'])):
+                # Touched but not edited (git checkout, copy into the image, ...)
+                entry['mtime_ns'], entry['size'] = st.st_mtime_ns, st.st_size
+                changed = True
+                continue
+
+            # Same newline handling as reading the file in text mode
+            content = raw.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+            post = compile_post(filename, content)
+            _write_atomic(_body_path(post['slug']), post.pop('content'))
+            files[filename] = {'mtime_ns': st.st_mtime_ns, 'size': st.st_size, 'sha256': sha, 'post': post}
+            compiled.append(filename)
+            changed = True
+
+        for filename in set(files) - seen:
+            removed = files.pop(filename)
+            try:
+                os.remove(_body_path(removed['post']['slug']))
+            except OSError:
+                pass
+            changed = True
+
+        if changed or index.get('version') is None:
+            index['version'] = _compute_version(files)
+            _write_atomic(_index_path(), json.dumps(index))
+            _index_mtime = os.stat(_index_path()).st_mtime_ns
+        _index = index
+        return compiled
+
+def get_posts_version():
+    """Short hash identifying the current set of compiled posts; changes
+    whenever any post is added, removed or edited."""
+    with _lock:
+        return _load_index()['version']
+
+def get_compiled_posts():
+    """Metadata for every post, newest first. Bodies are not included; load
+    them per post with read_post_body()."""
+    refresh_post_index()
+    with _lock:
+        posts = [dict(entry['post']) for entry in _load_index()['files'].values()]
+    posts.sort(key=lambda x: x["date"], reverse=True)
+    return posts
+
+def read_post_body(slug):
+    try:
+        with open(_body_path(slug), 'r', encoding='utf-8') as f:
+            return f.read()
+    except OSError:
+        return None
+
+if __name__ == '__main__':
+    force = '--rebuild' in sys.argv
+    compiled = refresh_post_index(force=force)
+    total = len(_index['files'])
+    print(f"[post_index] {len(compiled)} of {total} posts compiled into {POST_INDEX_DIR}/ (version {_index['version']})")
+
+    from search_index import refresh_search_index
+    if refresh_search_index(force=force):
+        print("[post_index] Search index rebuilt")
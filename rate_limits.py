@@ -0,0 +1,66 @@
+import time
+from db_pool import get_db
+
+# Bucketed counters for "at most N events per key in the last window". Each
+# hit bumps one (scope, key, bucket) row, and a check sums the handful of
+# buckets still inside the window through the primary key, so neither cost
+# depends on how big analytics_pageviews or comments get. Windows slide in
+# bucket-sized steps.
+#
+# scope: (window seconds, bucket seconds, limit)
+RATE_LIMITS = {
+    'post_view': (30 * 24 * 60 * 60, 24 * 60 * 60, 5),
+    'comment': (60 * 60, 5 * 60, 10),
+    'reply': (10 * 60, 60, 5),
+}
+PRUNE_INTERVAL = 60 * 60
+
+_last_prune = 0
+
+def _bucket(scope, now=None):
+    return int(now or time.time()) // RATE_LIMITS[scope][1]
+
+def post_view_key(slug, ip_hash):
+    return f'{slug}:{ip_hash}'
+
+def comment_keys(user_id, ip_hash):
+    # Comment limits apply per account and per address
+    return [f'user:{user_id}', f'ip:{ip_hash}']
+
+def record_hits(scope, keys, amount=1, conn=None):
+    """Count a hit for each key. Runs on the caller's connection and leaves
+    committing to the caller so it can share their transaction."""
+    conn = conn or get_db()
+    bucket = _bucket(scope)
+    conn.executemany('''
+        INSERT INTO rate_limit_buckets (scope, key, bucket, count) VALUES (?, ?, ?, ?)
+        ON CONFLICT(scope, key, bucket) DO UPDATE SET count = count + excluded.count
+    ''', [(scope, key, bucket, amount) for key in keys])
+
+def get_count(scope, key):
+    window, bucket_size, _ = RATE_LIMITS[scope]
+    oldest = _bucket(scope, time.time() - window) + 1
+    row = get_db().execute('''
+        SELECT COALESCE(SUM(count), 0) FROM rate_limit_buckets
+        WHERE scope = ? AND key = ? AND bucket >= ?
+    ''', (scope, key, oldest)).fetchone()
+    return row[0]
+
+def within_limit(scope, *keys, pending=0):
+    """True while every key is under the scope's limit. pending adds hits
+    that are known but not written yet."""
+    limit = RATE_LIMITS[scope][2]
+    return all(get_count(scope, key) + pending < limit for key in keys)
+
+def prune_rate_limits(conn=None, force=False):
+    global _last_prune
+    now = time.time()
+    if not force and now - _last_prune < PRUNE_INTERVAL:
+        return 0
+    _last_prune = now
+    conn = conn or get_db()
+    removed = 0
+    for scope, (window, _, _) in RATE_LIMITS.items():
+        removed += conn.execute('DELETE FROM rate_limit_buckets WHERE scope = ? AND bucket <= ?', (scope, _bucket(scope, now - window))).rowcount
+    conn.commit()
+    return removed
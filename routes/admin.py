@@ -1,11 +1,14 @@
-import sqlite3
-import json
 import html
 from datetime import datetime, timezone, timedelta
 from flask import Blueprint, request, jsonify, render_template
-from extensions import DB_PATH, get_client_ip, hash_ip, cache
-from db_helpers import get_current_user, add_comment
+from extensions import get_client_ip, hash_ip, cache
+from db_pool import get_db
+from db_helpers import get_current_user, invalidate_user, add_comment
 from post_helpers import get_all_posts
+from analytics_buffer import get_buffer_stats
+from ip_enrichment import get_enrichment_stats
+from analytics_rollups import unique_visitors
+from blocklist import refresh_blocklist, blocked_range, add_range, check_range, asn_networks
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -24,8 +27,7 @@ def admin_users():
     page, per_page = request.args.get('page', 1, type=int), request.args.get('per_page', 20, type=int)
     offset = (page - 1) * per_page
     
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('SELECT COUNT(*) FROM users')
     total_users = cursor.fetchone()[0]
@@ -33,23 +35,22 @@ def admin_users():
     
     cursor.execute('SELECT * FROM users ORDER BY created_at DESC LIMIT ? OFFSET ?', (per_page, offset))
     users = [dict(row) for row in cursor.fetchall()]
-    conn.close()
     return jsonify({"users": users, "page": page, "total_pages": total_pages, "total_users": total_users})
 
 @admin_bp.route('/api/admin/users/<int:user_id>/ban', methods=['POST'])
 def admin_ban_user(user_id):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     conn.execute('UPDATE users SET is_banned = 1 WHERE id = ?', (user_id,))
     conn.commit()
-    conn.close()
+    invalidate_user(user_id)
     return jsonify({"success": True})
 
 @admin_bp.route('/api/admin/users/<int:user_id>/unban', methods=['POST'])
 def admin_unban_user(user_id):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     conn.execute('UPDATE users SET is_banned = 0 WHERE id = ?', (user_id,))
     conn.commit()
-    conn.close()
+    invalidate_user(user_id)
     return jsonify({"success": True})
 
 @admin_bp.route('/api/admin/blocked_ips')
@@ -57,8 +58,7 @@ def admin_blocked_ips():
     page, per_page = request.args.get('page', 1, type=int), request.args.get('per_page', 20, type=int)
     offset = (page - 1) * per_page
     
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('SELECT COUNT(*) FROM blocked_ips')
     total_records = cursor.fetchone()[0]
@@ -66,46 +66,36 @@ def admin_blocked_ips():
     
     cursor.execute('SELECT * FROM blocked_ips ORDER BY created_at DESC LIMIT ? OFFSET ?', (per_page, offset))
     blocked_ips = [dict(row) for row in cursor.fetchall()]
-    conn.close()
     return jsonify({"blocked_ips": blocked_ips, "page": page, "total_pages": total_pages, "total_records": total_records})
 
 @admin_bp.route('/api/admin/blocked_ips/<int:id>/analysis')
 def admin_blocked_ip_analysis(id):
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('SELECT * FROM blocked_ips WHERE id = ?', (id,))
     row = cursor.fetchone()
     
     if not row:
-        conn.close()
         return jsonify({"error": "Not found"}), 404
         
     ip_data = dict(row)
-    extra_info_str = ip_data.get('extra_info')
     analysis = {"id": ip_data['id'], "ip": ip_data['ip_address'], "country": ip_data['country'], "fingerprint_hash": None, "fingerprint_shared_count": 0, "related_ips": [], "details": {}}
 
-    if extra_info_str:
-        try:
-            extra = json.loads(extra_info_str)
-            client_fp = extra.get('client_fingerprint', {})
-            analysis['details']['screen_res'] = f"{client_fp.get('screen_width', '?')}x{client_fp.get('screen_height', '?')}"
-            analysis['details']['timezone'] = client_fp.get('timezone', 'Unknown')
-            analysis['details']['platform'] = client_fp.get('platform', 'Unknown')
-            analysis['details']['renderer'] = client_fp.get('webgl_renderer', 'Unknown')
-            
-            fp_hash = client_fp.get('fingerprint_hash')
-            if fp_hash:
-                analysis['fingerprint_hash'] = fp_hash
-                search_pattern = f'%"{fp_hash}"%'
-                cursor.execute('SELECT ip_address, created_at FROM blocked_ips WHERE extra_info LIKE ? AND id != ? ORDER BY created_at DESC LIMIT 50', (search_pattern, id))
-                related_rows = cursor.fetchall()
-                analysis['fingerprint_shared_count'] = len(related_rows)
-                analysis['related_ips'] = [{"ip": r['ip_address'], "date": r['created_at']} for r in related_rows[:10]]
-        except Exception as e:
-            print(f"Error parsing extra info: {e}")
-            
-    conn.close()
+    if ip_data.get('extra_info'):
+        # Fingerprint fields are extracted into indexed columns at write time
+        analysis['details']['screen_res'] = ip_data['screen_res'] or '?x?'
+        analysis['details']['timezone'] = ip_data['timezone'] or 'Unknown'
+        analysis['details']['platform'] = ip_data['platform'] or 'Unknown'
+        analysis['details']['renderer'] = ip_data['webgl_renderer'] or 'Unknown'
+
+        fp_hash = ip_data['fingerprint_hash']
+        if fp_hash:
+            analysis['fingerprint_hash'] = fp_hash
+            cursor.execute('SELECT ip_address, created_at FROM blocked_ips WHERE fingerprint_hash = ? AND id != ? ORDER BY created_at DESC LIMIT 50', (fp_hash, id))
+            related_rows = cursor.fetchall()
+            analysis['fingerprint_shared_count'] = len(related_rows)
+            analysis['related_ips'] = [{"ip": r['ip_address'], "date": r['created_at']} for r in related_rows[:10]]
+
     return jsonify(analysis)
 
 @admin_bp.route('/api/admin/invoicing')
@@ -113,8 +103,7 @@ def admin_invoicing():
     page, per_page = request.args.get('page', 1, type=int), request.args.get('per_page', 20, type=int)
     offset = (page - 1) * per_page
     
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('SELECT SUM(data_sent) as total_bytes, COUNT(CASE WHEN ip_type = 0 THEN 1 END) as residential_count, COUNT(*) as total_records FROM blocked_ips WHERE data_sent > 0')
     summary_row = cursor.fetchone()
@@ -129,7 +118,6 @@ def admin_invoicing():
     
     cursor.execute('SELECT id, ip_address, ip_type, data_sent, created_at FROM blocked_ips WHERE data_sent > 0 ORDER BY data_sent DESC LIMIT ? OFFSET ?', (per_page, offset))
     rows = cursor.fetchall()
-    conn.close()
     
     total_pages = (total_records + per_page - 1) // per_page if total_records > 0 else 1
     invoices = []
@@ -150,24 +138,19 @@ def admin_invoicing():
 
 @admin_bp.route('/api/admin/blocked_ips/<int:id>/unblock', methods=['POST'])
 def admin_unblock_ip(id):
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('SELECT ip_address, extra_info FROM blocked_ips WHERE id = ?', (id,))
+    cursor.execute('SELECT ip_address, fingerprint_hash FROM blocked_ips WHERE id = ?', (id,))
     row = cursor.fetchone()
     if row:
-        ip, extra_info_str = row['ip_address'], row['extra_info']
-        if extra_info_str:
-            try:
-                client_fp = json.loads(extra_info_str).get('client_fingerprint')
-                if isinstance(client_fp, dict) and client_fp.get('fingerprint_hash'):
-                    cursor.execute('DELETE FROM blocked_fingerprints WHERE fingerprint_hash = ?', (client_fp['fingerprint_hash'],))
-            except: pass
+        ip = row['ip_address']
+        if row['fingerprint_hash']:
+            cursor.execute('DELETE FROM blocked_fingerprints WHERE fingerprint_hash = ?', (row['fingerprint_hash'],))
         cursor.execute('DELETE FROM blocked_ips WHERE ip_address = ?', (ip,))
         conn.commit()
+        refresh_blocklist(force=True)
         cache.delete(f'honeypot_blocked_{ip}')
         cache.delete(f'blocked_{ip}')
-    conn.close()
     return jsonify({"success": True})
 
 @admin_bp.route('/api/admin/blocked_ips/lookup')
@@ -176,16 +159,72 @@ def admin_lookup_ip():
     if not ip:
         return jsonify({"error": "Missing IP"}), 400
         
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('SELECT * FROM blocked_ips WHERE ip_address = ? ORDER BY created_at DESC', (ip,))
     rows = cursor.fetchall()
     history = [dict(row) for row in rows]
-    conn.close()
     
     is_blocked_cache = cache.get(f'honeypot_blocked_{ip}') or cache.get(f'blocked_{ip}')
-    return jsonify({"ip": ip, "is_blocked": bool(rows) or bool(is_blocked_cache), "history": history, "cache_status": bool(is_blocked_cache)})
+    refresh_blocklist()
+    blocking_range = blocked_range(ip)
+    return jsonify({"ip": ip, "is_blocked": bool(rows) or bool(is_blocked_cache) or bool(blocking_range), "history": history, "cache_status": bool(is_blocked_cache), "range": blocking_range})
+
+@admin_bp.route('/api/admin/blocked_ranges')
+def admin_blocked_ranges():
+    page, per_page = request.args.get('page', 1, type=int), request.args.get('per_page', 20, type=int)
+    offset = (page - 1) * per_page
+
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT COUNT(*) FROM blocked_ranges')
+    total_records = cursor.fetchone()[0]
+    total_pages = (total_records + per_page - 1) // per_page if total_records > 0 else 1
+
+    cursor.execute('SELECT * FROM blocked_ranges ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?', (per_page, offset))
+    blocked_ranges = [dict(row) for row in cursor.fetchall()]
+    return jsonify({"blocked_ranges": blocked_ranges, "page": page, "total_pages": total_pages, "total_records": total_records})
+
+@admin_bp.route('/api/admin/blocked_ranges', methods=['POST'])
+def admin_add_blocked_range():
+    # {"cidr": "203.0.113.0/24"} or {"asn": 64496} (expanded through the
+    # offline ASN database), with an optional "reason"
+    data = request.json or {}
+    reason = data.get('reason', 'Manual Admin Block')
+    if data.get('asn'):
+        try:
+            asn = int(data['asn'])
+            cidrs = asn_networks(asn)
+        except (TypeError, ValueError):
+            return jsonify({"error": "Invalid ASN"}), 400
+        except OSError:
+            return jsonify({"error": "ASN database not available"}), 400
+        if not cidrs:
+            return jsonify({"error": "No ranges found for ASN"}), 404
+    elif data.get('cidr'):
+        asn, cidrs = None, [data['cidr']]
+    else:
+        return jsonify({"error": "Missing params"}), 400
+
+    # Check every range before writing any; the block check uses remote_addr,
+    # so that is the address that must stay reachable
+    try:
+        cidrs = [check_range(cidr, {request.remote_addr, get_client_ip()}) for cidr in cidrs]
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    conn = get_db()
+    added = [add_range(conn, cidr, reason, source='asn' if asn else 'manual', asn=asn) for cidr in cidrs]
+    conn.commit()
+    refresh_blocklist(force=True)
+    return jsonify({"success": True, "ranges": added})
+
+@admin_bp.route('/api/admin/blocked_ranges/<int:id>/unblock', methods=['POST'])
+def admin_unblock_range(id):
+    conn = get_db()
+    conn.execute('DELETE FROM blocked_ranges WHERE id = ?', (id,))
+    conn.commit()
+    refresh_blocklist(force=True)
+    return jsonify({"success": True})
 
 @admin_bp.route('/api/admin/blocked_ips/action', methods=['POST'])
 def admin_blocked_ip_action():
@@ -194,17 +233,12 @@ def admin_blocked_ip_action():
     if not ip or not action:
         return jsonify({"error": "Missing params"}), 400
         
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     cursor = conn.cursor()
     if action == 'unblock':
-        cursor.execute('SELECT extra_info FROM blocked_ips WHERE ip_address = ?', (ip,))
+        cursor.execute('SELECT DISTINCT fingerprint_hash FROM blocked_ips WHERE ip_address = ? AND fingerprint_hash IS NOT NULL', (ip,))
         for row in cursor.fetchall():
-            if row[0]:
-                try:
-                    fp_hash = json.loads(row[0]).get('client_fingerprint', {}).get('fingerprint_hash')
-                    if fp_hash:
-                        cursor.execute('DELETE FROM blocked_fingerprints WHERE fingerprint_hash = ?', (fp_hash,))
-                except: pass
+            cursor.execute('DELETE FROM blocked_fingerprints WHERE fingerprint_hash = ?', (row[0],))
         cursor.execute('DELETE FROM blocked_ips WHERE ip_address = ?', (ip,))
         cache.delete(f'honeypot_blocked_{ip}')
         cache.delete(f'blocked_{ip}')
@@ -214,7 +248,7 @@ def admin_blocked_ip_action():
         cache.set(f'honeypot_blocked_{ip}', True, timeout=60 * 60 * 24 * 365 * 100)
     
     conn.commit()
-    conn.close()
+    refresh_blocklist(force=True)
     return jsonify({"success": True})
 
 @admin_bp.route('/api/admin/comments')
@@ -222,8 +256,7 @@ def admin_comments():
     page, per_page = request.args.get('page', 1, type=int), request.args.get('per_page', 20, type=int)
     slug_filter, offset = request.args.get('slug'), (page - 1) * per_page
     
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     
     if slug_filter:
@@ -241,7 +274,6 @@ def admin_comments():
         cursor.execute(f'{query_str} ORDER BY c.created_at DESC LIMIT ? OFFSET ?', (per_page, offset))
         
     comments = [dict(row) for row in cursor.fetchall()]
-    conn.close()
     
     posts_map = {post['slug']: post for post in get_all_posts()}
     for c in comments:
@@ -252,24 +284,22 @@ def admin_comments():
 
 @admin_bp.route('/api/analytics/overview')
 def analytics_overview():
-    conn = sqlite3.connect(DB_PATH)
+    # Served from the daily rollups kept by analytics_rollups
+    conn = get_db()
     cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM analytics_pageviews WHERE event_type = 'view'")
+    cursor.execute("SELECT COALESCE(SUM(count), 0) FROM analytics_daily WHERE event_type = 'view'")
     total_views = cursor.fetchone()[0]
-    cursor.execute("SELECT COUNT(DISTINCT ip_hash) FROM analytics_pageviews WHERE event_type = 'view'")
-    total_unique_views = cursor.fetchone()[0]
-    cursor.execute("SELECT COUNT(*) FROM analytics_pageviews WHERE event_type = 'share'")
+    total_unique_views = unique_visitors(conn)
+    cursor.execute("SELECT COALESCE(SUM(count), 0) FROM analytics_daily WHERE event_type = 'share'")
     total_shares = cursor.fetchone()[0]
     
-    thirty_days_ago = (datetime.now() - timedelta(days=30)).isoformat()
-    cursor.execute("SELECT COUNT(*) FROM analytics_pageviews WHERE event_type = 'view' AND viewed_at > ?", (thirty_days_ago,))
+    since_day = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
+    cursor.execute("SELECT COALESCE(SUM(count), 0) FROM analytics_daily WHERE event_type = 'view' AND day >= ?", (since_day,))
     views_30d = cursor.fetchone()[0]
-    cursor.execute("SELECT COUNT(DISTINCT ip_hash) FROM analytics_pageviews WHERE event_type = 'view' AND viewed_at > ?", (thirty_days_ago,))
-    visitors_30d = cursor.fetchone()[0]
+    visitors_30d = unique_visitors(conn, since_day)
     
-    cursor.execute('SELECT slug, COUNT(*) as count FROM analytics_pageviews WHERE event_type = "view" AND viewed_at > ? GROUP BY slug ORDER BY count DESC LIMIT 5', (thirty_days_ago,))
+    cursor.execute("SELECT slug, SUM(count) as count FROM analytics_daily WHERE event_type = 'view' AND day >= ? GROUP BY slug ORDER BY count DESC LIMIT 5", (since_day,))
     top_posts = [{"slug": r[0], "views": r[1]} for r in cursor.fetchall()]
-    conn.close()
     
     posts_map = {post['slug']: post for post in get_all_posts()}
     for p in top_posts:
@@ -278,15 +308,14 @@ def analytics_overview():
 
 @admin_bp.route('/api/analytics/chart')
 def analytics_chart():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     cursor = conn.cursor()
-    thirty_days_ago = (datetime.now() - timedelta(days=30)).isoformat()
-    cursor.execute('SELECT substr(viewed_at, 1, 10) as day, COUNT(*) FROM analytics_pageviews WHERE event_type = "view" AND viewed_at > ? GROUP BY day ORDER BY day', (thirty_days_ago,))
+    since_day = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
+    cursor.execute("SELECT day, SUM(count) FROM analytics_daily WHERE event_type = 'view' AND day >= ? GROUP BY day ORDER BY day", (since_day,))
     daily_views = [{"date": r[0], "views": r[1]} for r in cursor.fetchall()]
     
-    cursor.execute('SELECT substr(viewed_at, 1, 10) as day, COUNT(*) FROM analytics_pageviews WHERE event_type = "share" AND viewed_at > ? GROUP BY day ORDER BY day', (thirty_days_ago,))
+    cursor.execute("SELECT day, SUM(count) FROM analytics_daily WHERE event_type = 'share' AND day >= ? GROUP BY day ORDER BY day", (since_day,))
     daily_shares = {r[0]: r[1] for r in cursor.fetchall()}
-    conn.close()
     
     final_data = {v['date']: {"date": v['date'], "views": v['views'], "shares": 0, "new_posts": []} for v in daily_views}
     for date, count in daily_shares.items():
@@ -298,7 +327,7 @@ def analytics_chart():
     for p in get_all_posts():
         if p['date'] in final_data:
             final_data[p['date']]['new_posts'].append(p['title'])
-        elif p['date'] >= thirty_days_ago[:10]:
+        elif p['date'] >= since_day:
              final_data[p['date']] = {"date": p['date'], "views": 0, "shares": 0, "new_posts": [p['title']]}
              
     return jsonify(sorted(final_data.values(), key=lambda x: x['date']))
@@ -306,11 +335,10 @@ def analytics_chart():
 @admin_bp.route('/api/analytics/posts')
 def analytics_posts_list():
     page, per_page = request.args.get('page', 1, type=int), 20
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('SELECT slug, COUNT(*) as count FROM analytics_pageviews GROUP BY slug')
+    cursor.execute('SELECT slug, SUM(count) as count FROM analytics_daily GROUP BY slug')
     view_counts = {r[0]: r[1] for r in cursor.fetchall()}
-    conn.close()
     
     result = [{"slug": p['slug'], "title": p['title'], "date": p['date'], "image": p.get('image'), "views": view_counts.get(p['slug'], 0)} for p in get_all_posts()]
     result.sort(key=lambda x: x['date'], reverse=True)
@@ -320,44 +348,78 @@ def analytics_posts_list():
 
 @admin_bp.route('/api/analytics/posts/<slug>')
 def analytics_post_detail(slug):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('SELECT COUNT(*) FROM analytics_pageviews WHERE slug = ?', (slug,))
+    cursor.execute('SELECT COALESCE(SUM(count), 0) FROM analytics_daily WHERE slug = ?', (slug,))
     total_views = cursor.fetchone()[0]
     
-    thirty_days_ago = (datetime.now() - timedelta(days=30)).isoformat()
-    cursor.execute('SELECT substr(viewed_at, 1, 10) as day, COUNT(*) FROM analytics_pageviews WHERE slug = ? AND viewed_at > ? AND event_type = "view" GROUP BY day ORDER BY day', (slug, thirty_days_ago))
+    since_day = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
+    cursor.execute("SELECT day, SUM(count) FROM analytics_daily WHERE slug = ? AND event_type = 'view' AND day >= ? GROUP BY day ORDER BY day", (slug, since_day))
     daily_views = [{"date": r[0], "views": r[1]} for r in cursor.fetchall()]
 
-    cursor.execute('SELECT substr(viewed_at, 1, 10) as day, COUNT(*) FROM analytics_pageviews WHERE slug = ? AND viewed_at > ? AND event_type = "share" GROUP BY day ORDER BY day', (slug, thirty_days_ago))
+    cursor.execute("SELECT day, SUM(count) FROM analytics_daily WHERE slug = ? AND event_type = 'share' AND day >= ? GROUP BY day ORDER BY day", (slug, since_day))
     daily_shares = [{"date": r[0], "shares": r[1]} for r in cursor.fetchall()]
     
-    cursor.execute('SELECT platform, COUNT(*) as count FROM analytics_pageviews WHERE slug = ? AND event_type = "share" AND platform IS NOT NULL AND platform != "unknown" GROUP BY platform ORDER BY count DESC', (slug,))
+    cursor.execute("SELECT platform, SUM(count) as count FROM analytics_daily WHERE slug = ? AND event_type = 'share' AND platform NOT IN ('', 'unknown') GROUP BY platform ORDER BY count DESC", (slug,))
     shares_platform = [{"platform": r[0], "count": r[1]} for r in cursor.fetchall()]
-    conn.close()
 
     post_meta = next((p for p in get_all_posts() if p['slug'] == slug), {})
     return jsonify({"slug": slug, "title": post_meta.get('title', slug), "date": post_meta.get('date', '-'), "image": post_meta.get('image'), "total_views": total_views, "daily_views": daily_views, "daily_shares": daily_shares, "shares_platform": shares_platform})
 
 @admin_bp.route('/api/analytics/shares_by_platform')
 def analytics_shares_by_platform():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('SELECT platform, COUNT(*) as count FROM analytics_pageviews WHERE event_type = "share" AND platform IS NOT NULL AND platform != "unknown" GROUP BY platform ORDER BY count DESC')
+    cursor.execute("SELECT platform, SUM(count) as count FROM analytics_daily WHERE event_type = 'share' AND platform NOT IN ('', 'unknown') GROUP BY platform ORDER BY count DESC")
     data = [{"platform": r[0], "count": r[1]} for r in cursor.fetchall()]
-    conn.close()
     return jsonify(data)
 
 @admin_bp.route('/api/analytics/daily_shares_platform')
 def analytics_daily_shares_platform():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     cursor = conn.cursor()
-    thirty_days_ago = (datetime.now() - timedelta(days=30)).isoformat()
-    cursor.execute('SELECT substr(viewed_at, 1, 10) as day, platform, COUNT(*) as count FROM analytics_pageviews WHERE event_type = "share" AND viewed_at > ? AND platform IS NOT NULL AND platform != "unknown" GROUP BY day, platform ORDER BY day', (thirty_days_ago,))
+    since_day = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
+    cursor.execute("SELECT day, platform, SUM(count) as count FROM analytics_daily WHERE event_type = 'share' AND day >= ? AND platform NOT IN ('', 'unknown') GROUP BY day, platform ORDER BY day", (since_day,))
     data = [{"date": r[0], "platform": r[1], "count": r[2]} for r in cursor.fetchall()]
-    conn.close()
     return jsonify(data)
 
+@admin_bp.route('/api/analytics/browsers')
+def analytics_browsers():
+    # Grouped on the integer user_agent_id, then labelled from user_agents
+    conn = get_db()
+    cursor = conn.cursor()
+    since_day = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
+    cursor.execute('''
+        SELECT COALESCE(ua.browser, 'Unknown'), COALESCE(ua.os, 'Unknown'), SUM(pv.count) as count
+        FROM (SELECT user_agent_id, COUNT(*) as count FROM analytics_pageviews WHERE event_type = 'view' AND viewed_at >= ? GROUP BY user_agent_id) pv
+        LEFT JOIN user_agents ua ON ua.id = pv.user_agent_id
+        GROUP BY 1, 2 ORDER BY count DESC
+    ''', (since_day,))
+    data = [{"browser": r[0], "os": r[1], "count": r[2]} for r in cursor.fetchall()]
+    return jsonify(data)
+
+@admin_bp.route('/api/analytics/referrers')
+def analytics_referrers():
+    conn = get_db()
+    cursor = conn.cursor()
+    since_day = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
+    cursor.execute('''
+        SELECT r.host, SUM(pv.count) as count
+        FROM (SELECT referrer_id, COUNT(*) as count FROM analytics_pageviews WHERE event_type = 'view' AND viewed_at >= ? AND referrer_id IS NOT NULL GROUP BY referrer_id) pv
+        JOIN referrers r ON r.id = pv.referrer_id
+        GROUP BY r.host ORDER BY count DESC LIMIT 20
+    ''', (since_day,))
+    data = [{"host": r[0], "count": r[1]} for r in cursor.fetchall()]
+    return jsonify(data)
+
+@admin_bp.route('/api/analytics/buffer')
+def analytics_buffer_stats():
+    return jsonify(get_buffer_stats())
+
+@admin_bp.route('/api/admin/ip_enrichment')
+def admin_ip_enrichment_stats():
+    return jsonify(get_enrichment_stats())
+
 @admin_bp.route('/api/admin/comments/reply', methods=['POST'])
 def admin_reply_to_comment():
     data = request.get_json()
@@ -6,18 +6,14 @@ from db_helpers import (
     get_current_user, get_comments_for_post, check_comment_rate_limit,
     check_reply_rate_limit, add_comment, get_comment_by_id, edit_comment, delete_comment, purge_comment
 )
-from post_helpers import get_all_posts
+from search_index import find_posts
 
 api_bp = Blueprint('api', __name__)
 
 @api_bp.route('/api/search')
 def api_search():
-    query = request.args.get('q', '').lower()
-    results = []
-    if query:
-        for p in get_all_posts():
-            if query in p['title'].lower() or query in p['summary'].lower() or any(query in t.lower() for t in p['tags']):
-                results.append(p)
+    query = request.args.get('q', '')
+    results = find_posts(query) if query else []
     return jsonify({"results": results})
 
 @api_bp.route('/api/comments/<slug>', methods=['GET', 'POST'])
@@ -1,140 +1,113 @@
 import os
-import io
-import requests
-from flask import Blueprint, send_from_directory, request, app, Response
-from PIL import Image
-from extensions import cache, CACHE_TIMEOUT, COMPRESSION_QUALITY, MAX_IMAGE_WIDTH
+from urllib.parse import urlencode
+from flask import Blueprint, send_from_directory, send_file, request, abort, redirect
+from werkzeug.security import safe_join
+from image_variants import get_variant, negotiate_format, varies_by_accept, format_names, source_digest, IMAGE_EXTENSIONS, MODERN_MIMETYPES
+from asset_fingerprints import content_hash, split_fingerprint, ASSET_MAX_AGE, IMMUTABLE_MAX_AGE
 
 assets_bp = Blueprint('assets', __name__)
 
-def compress_image(image_path, max_width=MAX_IMAGE_WIDTH, quality=COMPRESSION_QUALITY):
-    MAX_HEIGHT = 1600
-    cache_key = f'img_{image_path}_{max_width}_{quality}'
-    cached_image = cache.get(cache_key)
-    if cached_image is not None:
-        return cached_image
-    
-    try:
-        if not image_path.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.webp')):
-            with open(image_path, 'rb') as f:
-                file_data = f.read()
-            cache.set(cache_key, file_data, CACHE_TIMEOUT)
-            return file_data
-            
-        img = Image.open(image_path)
-        needs_resize = False
-        ratio = 1.0
-        
-        if img.width > max_width:
-            ratio = max_width / img.width
-            needs_resize = True
-        if img.height > MAX_HEIGHT:
-            needs_resize = True
-            ratio = min(ratio, MAX_HEIGHT / img.height)
-            
-        if needs_resize:
-            img = img.resize((int(img.width * ratio), int(img.height * ratio)), Image.LANCZOS)
-        
-        output = io.BytesIO()
-        fmt = image_path.lower().split('.')[-1]
-        if fmt == 'jpg':
-            fmt = 'jpeg'
-        
-        final_quality = min(quality, 75) if img.width * img.height > 2000000 else quality
-        save_kwargs = {'format': fmt, 'optimize': True, 'quality': final_quality}
-        if fmt == 'jpeg':
-            save_kwargs['subsampling'] = 0
-        img.save(output, **save_kwargs)
-        compressed_data = output.getvalue()
-        cache.set(cache_key, compressed_data, CACHE_TIMEOUT)
-        return compressed_data
-    except Exception as e:
-        print(f"Error compressing {image_path}: {e}")
-        with open(image_path, 'rb') as f:
-            file_data = f.read()
-        cache.set(cache_key, file_data, CACHE_TIMEOUT)
-        return file_data
+VIDEO_MIMETYPES = {'.mp4': 'video/mp4', '.webm': 'video/webm', '.mov': 'video/quicktime', '.ogg': 'video/ogg'}
 
-def generate_image_sizes(image_path):
-    sizes = {'placeholder': (50, 20), 'thumbnail': (800, 70), 'full': (2000, 90)}
-    results = {}
-    for size_name, (width, quality) in sizes.items():
-        cache_key = f'img_{image_path}_{size_name}_{width}_{quality}'
-        cached_data = cache.get(cache_key)
-        if cached_data is not None:
-            results[size_name] = cached_data
-            continue
-        
-        try:
-            if not image_path.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.webp')):
-                with open(image_path, 'rb') as f:
-                    file_data = f.read()
-                results[size_name] = file_data
-                cache.set(cache_key, file_data, CACHE_TIMEOUT)
-                continue
-            
-            img = Image.open(image_path)
-            ratio = min(width / img.width, 1.0)
-            if ratio < 1.0:
-                img = img.resize((int(img.width * ratio), int(img.height * ratio)), Image.LANCZOS)
-            
-            output = io.BytesIO()
-            fmt = image_path.lower().split('.')[-1]
-            if fmt == 'jpg':
-                fmt = 'jpeg'
-            
-            save_kwargs = {'format': fmt, 'optimize': True, 'quality': quality}
-            if fmt == 'jpeg':
-                save_kwargs['subsampling'] = 0
-            img.save(output, **save_kwargs)
-            compressed_data = output.getvalue()
-            results[size_name] = compressed_data
-            cache.set(cache_key, compressed_data, CACHE_TIMEOUT)
-        except Exception as e:
-            print(f"Size gen error for {image_path}: {e}")
-            with open(image_path, 'rb') as f:
-                file_data = f.read()
-            results[size_name] = file_data
-            cache.set(cache_key, file_data, CACHE_TIMEOUT)
-    return results
+def send_hashed(path, etag, mimetype=None, immutable=False):
+    # send_file answers If-None-Match / If-Modified-Since with a 304 itself
+    response = send_file(os.path.abspath(path), mimetype=mimetype, etag=etag,
+                         max_age=IMMUTABLE_MAX_AGE if immutable else ASSET_MAX_AGE)
+    if immutable:
+        response.cache_control.immutable = True
+    return response
+
+def send_versioned(directory, filename):
+    """Serve directory/filename, where filename may carry a content fingerprint
+    from asset_url(). A current fingerprint is cached as immutable; a stale one
+    (page cached from before a deploy) still gets the current file, just with
+    the normal revalidating lifetime."""
+    path = safe_join(directory, filename)
+    fingerprint = None
+    if path is None or not os.path.isfile(path):
+        real_name, fingerprint = split_fingerprint(filename)
+        path = safe_join(directory, real_name)
+        if fingerprint is None or path is None or not os.path.isfile(path):
+            abort(404)
+    digest = content_hash(path)
+    return send_hashed(path, digest, immutable=fingerprint is not None and digest.startswith(fingerprint))
 
 @assets_bp.route('/style.css')
 def style():
-    return send_from_directory('.', 'style.css')
+    return send_versioned('.', 'style.css')
+
+@assets_bp.route('/style.<fingerprint>.css')
+def style_fingerprinted(fingerprint):
+    return send_versioned('.', f'style.{fingerprint}.css')
 
 @assets_bp.route('/static/<path:filename>')
 def serve_static(filename):
-    return send_from_directory('static', filename)
+    return send_versioned('static', filename)
+
+def send_video(path, mimetype):
+    """Serve a video through send_file, which answers single Range requests
+    (and If-Range, 416s and 304s) with a 206 read straight from the file."""
+    st = os.stat(path)
+    # mtime+size rather than a content hash: hashing a large video on first
+    # request would cost more than the bytes it saves
+    return send_hashed(path, f'{st.st_mtime_ns:x}-{st.st_size:x}', mimetype=mimetype)
 
-def respond_image(filepath, filename):
+def respond_image(directory, filename):
+    # Reject '..' and absolute paths before anything opens the file
+    filepath = safe_join(directory, filename)
+    if filepath is None:
+        abort(404)
     size = request.args.get('size', 'full')
-    if os.path.exists(filepath) and filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.webp')):
-        if size in ['placeholder', 'thumbnail', 'full']:
-            image_data = generate_image_sizes(filepath).get(size)
-        elif size == 'original':
-            with open(filepath, 'rb') as f:
-                image_data = f.read()
-        else:
-            image_data = compress_image(filepath)
-        
+    if os.path.exists(filepath) and filename.lower().endswith(IMAGE_EXTENSIONS):
         mimetype = f"image/{filename.lower().split('.')[-1]}"
         if mimetype == "image/jpg":
             mimetype = "image/jpeg"
-        # Access original response class
-        from flask import current_app
-        return current_app.response_class(image_data, mimetype=mimetype)
-    return send_from_directory(os.path.dirname(filepath), filename)
+        # Variants are named after the source hash, so it doubles as the ETag
+        digest = source_digest(filepath)
+        if size == 'original':
+            return send_hashed(filepath, digest, mimetype=mimetype)
+        # Pre-rendered on disk by image_variants; unknown sizes get the
+        # general-purpose compressed variant like before
+        variant = size if size in ('placeholder', 'thumbnail', 'full') else 'compressed'
+        fmt = None
+        if varies_by_accept(filepath):
+            # Each format gets its own ?format= URL, so shared caches that
+            # ignore Vary: Accept (Cloudflare's default) can still cache the
+            # image itself. Only the redirect to it depends on Accept.
+            requested = request.args.get('format')
+            if requested not in format_names(filepath):
+                fmt = negotiate_format(filepath, request.accept_mimetypes)
+                args = request.args.to_dict(flat=False)
+                args['format'] = [fmt or format_names(filepath)[-1]]
+                response = redirect(f'{request.path}?{urlencode(args, doseq=True)}')
+                response.vary.add('Accept')
+                response.cache_control.private = True
+                response.cache_control.max_age = ASSET_MAX_AGE
+                return response
+            if requested in MODERN_MIMETYPES:
+                fmt = requested
+        path = get_variant(filepath, variant, fmt)
+        etag = digest
+        if path != filepath:
+            etag = f'{digest}-{variant}-{fmt}' if fmt else f'{digest}-{variant}'
+            if fmt:
+                mimetype = MODERN_MIMETYPES[fmt]
+        return send_hashed(path, etag, mimetype=mimetype)
+    video_mimetype = VIDEO_MIMETYPES.get(os.path.splitext(filename.lower())[1])
+    if video_mimetype and os.path.isfile(filepath):
+        return send_video(filepath, video_mimetype)
+    return send_from_directory(directory, filename, max_age=ASSET_MAX_AGE)
 
 
 
 @assets_bp.route('/assets/<path:filename>')
 def serve_asset(filename):
-    return respond_image(os.path.join('posts/assets', filename), filename)
+    return respond_image('posts/assets', filename)
 
 @assets_bp.route('/posts/assets/<path:filename>')
 def serve_post_asset(filename):
-    return respond_image(os.path.join('posts/assets', filename), filename)
+    return respond_image('posts/assets', filename)
 
 @assets_bp.route('/posts/<post_slug>-assets/<path:filename>')
 def serve_post_specific_asset(post_slug, filename):
-    return respond_image(os.path.join(f'posts/{post_slug}-assets', filename), filename)
\ No newline at end of file
+    return respond_image(f'posts/{post_slug}-assets', filename)
\ No newline at end of file
@@ -1,9 +1,9 @@
 import os
-import sqlite3
 from datetime import datetime, timezone
 from flask import Blueprint, redirect, url_for, request, session, jsonify, render_template
-from extensions import oauth, DB_PATH
-from db_helpers import get_current_user
+from extensions import oauth
+from db_pool import get_db
+from db_helpers import get_current_user, invalidate_user
 
 # Hardcoded admin identity (provider-agnostic OAuth id). Set ADMIN_OAUTH_ID in
 # the environment to the oauth_id that should be granted admin on first login.
@@ -86,7 +86,7 @@ def auth_callback(provider):
     if not oauth_id:
         return "Could not retrieve user information", 400
         
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('SELECT id FROM users WHERE oauth_provider = ? AND oauth_id = ?', (provider, oauth_id))
     existing_user = cursor.fetchone()
@@ -107,7 +107,7 @@ def auth_callback(provider):
         user_id = cursor.lastrowid
         
     conn.commit()
-    conn.close()
+    invalidate_user(user_id)
     
     # Clear any pre-existing session data before binding the session to this
     # user (mitigates session fixation).
@@ -1,10 +1,12 @@
-import sqlite3
-import requests
 import json
 import uuid
 from datetime import datetime, timezone, timedelta
-from flask import Blueprint, request, render_template, make_response, jsonify, Response
-from extensions import IPHUB_KEY, DB_PATH, cache
+from flask import Blueprint, request, render_template, make_response, jsonify, redirect
+from extensions import cache
+from db_pool import get_db
+from ip_enrichment import enqueue as enqueue_ip_type
+from tarpit import TARPIT_URL, tarpit_link
+from blocklist import check_blocked, note_blocked, refresh_blocklist, promote_range, fingerprint_fields
 
 honeypot_bp = Blueprint('honeypot', __name__)
 
@@ -23,6 +25,7 @@ def _trap(reason_label):
     already_blocked = cache.get(f'honeypot_blocked_{ip}')
     cache.set(f'honeypot_blocked_{ip}', True, timeout=60 * 60 * 24 * 365 * 10)
     cache.set(f'blocked_{ip}', True, timeout=3600)
+    note_blocked(ip)
 
     if already_blocked:
         return  # Already logged on a prior concurrent request — skip the DB write
@@ -41,7 +44,7 @@ def _trap(reason_label):
     })
 
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cursor = conn.cursor()
         cursor.execute('SELECT id FROM blocked_ips WHERE ip_address = ?', (ip,))
         if not cursor.fetchone():
@@ -54,69 +57,27 @@ def _trap(reason_label):
                 (ip, user_agent, country, reason_label, blocked_until.isoformat(), extra)
             )
             conn.commit()
-        conn.close()
+            refresh_blocklist(force=True)
+            enqueue_ip_type(ip)
+            promote_range(ip)
     except Exception as e:
         print(f'[honeypot] DB error ({reason_label}): {e}')
 
-def get_ip_type(ip):
-    if not IPHUB_KEY:
-        return -1
-    try:
-        resp = requests.get(f'https://v2.api.iphub.info/ip/{ip}', headers={'X-Key': IPHUB_KEY}, timeout=3)
-        if resp.status_code == 200:
-            return resp.json().get('block', -1)
-    except:
-        pass
-    return -1
-
 def stream_heavy_block(ip, db_id):
-    current_type = -1
+    # IP type is filled in by the background enrichment worker
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('SELECT ip_type FROM blocked_ips WHERE id = ?', (db_id,))
-        row = cursor.fetchone()
-        current_type = row[0] if row else -1
-        
-        if (current_type == -1 or current_type is None) and IPHUB_KEY:
-            try:
-                r = requests.get(f"https://v2.api.iphub.info/ip/{ip}", headers={"X-Key": IPHUB_KEY}, timeout=3)
-                if r.status_code == 200:
-                    ctype = r.json().get('block')
-                    cursor.execute('UPDATE blocked_ips SET ip_type = ? WHERE id = ?', (ctype, db_id))
-                    conn.commit()
-                    current_type = ctype
-            except Exception as e:
-                print(f"IPHub Error: {e}")
-        conn.close()
-    except:
-        pass
-
-    def generate():
-        total_streamed = 0
-        limit = 5 * 1024 * 1024 * 1024
-        complex_path = "M 0 0 " + " ".join([f"Q {i%500} {(i*2)%500} {(i*3)%500} {(i*4)%500}" for i in range(100)])
-        svg_template = f"<svg width='500' height='500'><path d='{complex_path}' fill='none' stroke='black'/></svg>"
-        heavy_chunk = (svg_template * 500).encode('utf-8')
-        chunk_len = len(heavy_chunk)
-        
-        yield b"<!DOCTYPE html><html><head><title>Admin Panel Loading...</title></head><body><h1>Loading Assets...</h1><div style='display:none;'>"
-        chunk_accum = 0
-        try:
-            while total_streamed < limit:
-                yield heavy_chunk
-                total_streamed += chunk_len
-                chunk_accum += chunk_len
-            yield b"</div></body></html>"
-        finally:
-            if chunk_accum > 0:
-                try:
-                    with sqlite3.connect(DB_PATH) as conn:
-                        conn.execute('UPDATE blocked_ips SET data_sent = COALESCE(data_sent, 0) + ? WHERE id = ?', (chunk_accum, db_id))
-                except:
-                    pass
-
-    return Response(generate(), mimetype='text/html')
+        row = get_db().execute('SELECT ip_type FROM blocked_ips WHERE id = ?', (db_id,)).fetchone()
+        if row and (row[0] is None or row[0] == -1):
+            enqueue_ip_type(ip)
+    except Exception as e:
+        print(f"[honeypot] ip_type check failed: {e}")
+
+    if TARPIT_URL:
+        # The standalone asyncio server streams without holding a worker
+        return redirect(tarpit_link(ip, db_id, request.host))
+    # Without it there is no tarpit: streaming from a sync worker would pin
+    # it for as long as the scanner keeps reading
+    return render_template('blocked.html'), 403
 
 @honeypot_bp.before_app_request
 def check_suspicious_block():
@@ -126,50 +87,11 @@ def check_suspicious_block():
     if path.startswith('/api/honeypot/finalize'):
         return
 
-    is_blocked = False
-    tracking_id = request.cookies.get('wpadm_session')
-    db_id = None
-    
-    if tracking_id:
-        try:
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute('SELECT id FROM blocked_ips WHERE tracking_id = ?', (tracking_id,))
-            row = c.fetchone()
-            if row:
-                is_blocked = True
-                db_id = row[0]
-            conn.close()
-        except:
-             pass
-
-    if not is_blocked:
-        if cache.get(f'honeypot_blocked_{ip}'):
-            is_blocked = True
-        else:
-            try:
-                conn = sqlite3.connect(DB_PATH)
-                c = conn.cursor()
-                c.execute('SELECT id FROM blocked_ips WHERE ip_address = ?', (ip,))
-                row = c.fetchone()
-                if row:
-                    is_blocked = True
-                    cache.set(f'honeypot_blocked_{ip}', True, timeout=60 * 60 * 24 * 365 * 10)
-                conn.close()
-            except: pass
+    # Answered from the in-memory blocklist, not SQLite
+    is_blocked, db_id = check_blocked(ip, request.cookies.get('wpadm_session'))
 
     if is_blocked:
         if path == '/wp-admin-login':
-            if not db_id:
-                try:
-                    conn = sqlite3.connect(DB_PATH)
-                    cursor = conn.cursor()
-                    cursor.execute('SELECT id FROM blocked_ips WHERE ip_address = ? AND reason LIKE "%Honeypot%" ORDER BY id DESC LIMIT 1', (ip,))
-                    row = cursor.fetchone()
-                    conn.close()
-                    if row:
-                        db_id = row[0]
-                except: pass
             if db_id:
                 return stream_heavy_block(ip, db_id)
         return render_template('blocked.html'), 403
@@ -188,12 +110,11 @@ def honeypot():
     
     if tracking_id:
         try:
-            conn = sqlite3.connect(DB_PATH)
+            conn = get_db()
             c = conn.cursor()
             c.execute('SELECT id FROM blocked_ips WHERE tracking_id = ?', (tracking_id,))
             if c.fetchone():
                 cookie_blocked = True
-            conn.close()
         except: pass
         
     if cache.get(f'honeypot_blocked_{ip}') or cookie_blocked:
@@ -215,7 +136,7 @@ def honeypot():
     blocked_until = datetime.now(timezone.utc) + timedelta(seconds=block_duration)
     
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cursor = conn.cursor()
         cursor.execute('SELECT id FROM blocked_ips WHERE ip_address = ? AND reason LIKE "%Honeypot%"', (ip,))
         existing = cursor.fetchone()
@@ -226,7 +147,9 @@ def honeypot():
                 VALUES (?, ?, ?, ?, ?, ?, ?)
             ''', (ip, user_agent, country, 'Accessing /wp-admin-login (Honeypot - Initial)', blocked_until.isoformat(), json.dumps({'headers': headers_dict, 'initial_hit': True}), tracking_id))
             conn.commit()
-        conn.close()
+            refresh_blocklist(force=True)
+            enqueue_ip_type(ip)
+            promote_range(ip)
     except Exception as e:
         print(f"Error logging honeypot access: {e}")
         
@@ -237,7 +160,8 @@ def honeypot():
 def honeypot_finalize():
     tracking_id = request.cookies.get('wpadm_session')
     client_data = request.json or {}
-    fingerprint_hash = client_data.get('fingerprint_hash')
+    fingerprint = fingerprint_fields(client_data)
+    fingerprint_hash = fingerprint['fingerprint_hash']
     ip = request.remote_addr
     
     full_log = {
@@ -249,7 +173,7 @@ def honeypot_finalize():
     }
     
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cursor = conn.cursor()
         if fingerprint_hash:
             cursor.execute('SELECT id FROM blocked_fingerprints WHERE fingerprint_hash = ?', (fingerprint_hash,))
@@ -257,21 +181,26 @@ def honeypot_finalize():
                 cursor.execute('INSERT INTO blocked_fingerprints (fingerprint_hash, reason) VALUES (?, ?)', (fingerprint_hash, 'Associated with Honeypot Hit'))
         
         cursor.execute('''
-            UPDATE blocked_ips SET extra_info = ?, reason = ?, tracking_id = ?
+            UPDATE blocked_ips SET extra_info = ?, reason = ?, tracking_id = ?,
+                fingerprint_hash = ?, screen_res = ?, timezone = ?, platform = ?, webgl_renderer = ?
             WHERE ip_address = ? AND reason LIKE "Accessing /wp-admin-login (Honeypot - Initial)"
-        ''', (json.dumps(full_log), 'Accessing /wp-admin-login (Honeypot - Fingerprinted)', tracking_id, ip))
+        ''', (json.dumps(full_log), 'Accessing /wp-admin-login (Honeypot - Fingerprinted)', tracking_id,
+              fingerprint_hash, fingerprint['screen_res'], fingerprint['timezone'], fingerprint['platform'], fingerprint['webgl_renderer'], ip))
         
         if cursor.rowcount == 0:
             blocked_until = datetime.now(timezone.utc) + timedelta(days=365*100)
             country = request.headers.get('CF-IPCountry', 'Unknown')
             user_agent = request.user_agent.string
             cursor.execute('''
-                INSERT INTO blocked_ips (ip_address, user_agent, country, reason, blocked_until, extra_info, tracking_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (ip, user_agent, country, 'Accessing /wp-admin-login (Honeypot - Fingerprinted)', blocked_until.isoformat(), json.dumps(full_log), tracking_id))
+                INSERT INTO blocked_ips (ip_address, user_agent, country, reason, blocked_until, extra_info, tracking_id,
+                    fingerprint_hash, screen_res, timezone, platform, webgl_renderer)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (ip, user_agent, country, 'Accessing /wp-admin-login (Honeypot - Fingerprinted)', blocked_until.isoformat(), json.dumps(full_log), tracking_id,
+                  fingerprint_hash, fingerprint['screen_res'], fingerprint['timezone'], fingerprint['platform'], fingerprint['webgl_renderer']))
             
         conn.commit()
-        conn.close()
+        refresh_blocklist(force=True)
+        enqueue_ip_type(ip)
     except Exception as e:
         print(f"Error logging blocked IP: {e}")
         
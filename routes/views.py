@@ -1,21 +1,44 @@
 import os
 import uuid
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timedelta
 from flask import Blueprint, request, render_template, make_response, redirect, url_for
-from feedgen.feed import FeedGenerator
 from extensions import get_client_ip, hash_ip, cache, is_local
 from db_helpers import (
     get_view_count, get_shares_count, check_ip_rate_limit, 
-    has_user_viewed, increment_view_count, increment_shares_count, log_analytics_view,
+    has_user_viewed, increment_shares_count, log_analytics_view,
     get_current_user
 )
 from post_helpers import (
     get_all_posts, get_post_by_slug, get_tags, get_posts_by_tag, 
     get_share_platform_from_user_agent
 )
+from search_index import find_posts
+from feeds import get_feed
+from page_cache import cached_page, VIEW_COUNT_PLACEHOLDER, SHARES_COUNT_PLACEHOLDER
 
 views_bp = Blueprint('views', __name__)
 
+def page_url(page):
+    # Template global for pagination links; the static export swaps in its
+    # own version that points at /page/<n>/ directories
+    return f'{request.path}?page={page}'
+
+def build_tag_cloud():
+    tags = get_tags()
+    max_count = max((tag['count'] for tag in tags), default=1)
+    min_count = min((tag['count'] for tag in tags), default=1)
+    count_range = max_count - min_count
+
+    tag_cloud = []
+    for tag in tags:
+        weight = (tag['count'] - min_count) / count_range if count_range else 0
+        # grey scale: smallest -> #888 (136), largest -> #ffffff (255)
+        gray = int(136 + weight * 119)
+        gray_hex = f"{gray:02x}"
+        color = f"#{gray_hex}{gray_hex}{gray_hex}"
+        tag_cloud.append({**tag, 'font_size': round(1 + weight * 1.25, 2), 'color': color, 'weight': weight})
+    return tag_cloud
+
 @views_bp.route('/')
 def index():
     page = request.args.get('page', 1, type=int)
@@ -26,7 +49,7 @@ def index():
     
     start = (page - 1) * per_page
     posts = all_posts[start:start+per_page]
-    return render_template('index.html', posts=posts, year=datetime.now().year, page=page, total_pages=total_pages)
+    return cached_page(lambda: render_template('index.html', posts=posts, year=datetime.now().year, page=page, total_pages=total_pages), page=page, total_pages=total_pages)
 
 @views_bp.route('/posts/<slug>')
 def post(slug):
@@ -50,10 +73,8 @@ def post(slug):
         
         has_viewed = has_user_viewed(slug, user_id)
         within_rate_limit = check_ip_rate_limit(slug, ip_hash)
-        log_analytics_view(slug, user_id, ip_hash, user_agent, request.referrer)
-        
-        if not has_viewed and within_rate_limit:
-            increment_view_count(slug)
+        # Counted on flush, once user_views confirms it's this visitor's first
+        log_analytics_view(slug, user_id, ip_hash, user_agent, request.referrer, count_view=not has_viewed and within_rate_limit)
             
     view_count = get_view_count(slug)
     shares_count = get_shares_count(slug)
@@ -61,7 +82,11 @@ def post(slug):
     post_url = f"https://blog.joshattic.us/posts/{post_item['slug']}"
     absolute_image_url = f"https://blog.joshattic.us/{post_item['image']}"
     
-    response = make_response(render_template('post.html', post=post_item, year=datetime.now().year, url=post_url, absolute_image_url=absolute_image_url, view_count=view_count, shares_count=shares_count))
+    html = cached_page(
+        lambda: render_template('post.html', post=post_item, year=datetime.now().year, url=post_url, absolute_image_url=absolute_image_url, view_count=VIEW_COUNT_PLACEHOLDER, shares_count=SHARES_COUNT_PLACEHOLDER),
+        {VIEW_COUNT_PLACEHOLDER: view_count, SHARES_COUNT_PLACEHOLDER: shares_count}
+    )
+    response = make_response(html)
     if not platform and not request.cookies.get('blog_user_id'):
         response.set_cookie('blog_user_id', user_id, expires=datetime.now() + timedelta(days=365), httponly=True, samesite='Lax', secure=not is_local)
     return response
@@ -72,21 +97,7 @@ def bot_page():
 
 @views_bp.route('/tags')
 def tags():
-    tags = get_tags()
-    max_count = max((tag['count'] for tag in tags), default=1)
-    min_count = min((tag['count'] for tag in tags), default=1)
-    count_range = max_count - min_count
-
-    tag_cloud = []
-    for tag in tags:
-        weight = (tag['count'] - min_count) / count_range if count_range else 0
-        # grey scale: smallest -> #888 (136), largest -> #ffffff (255)
-        gray = int(136 + weight * 119)
-        gray_hex = f"{gray:02x}"
-        color = f"#{gray_hex}{gray_hex}{gray_hex}"
-        tag_cloud.append({**tag, 'font_size': round(1 + weight * 1.25, 2), 'color': color, 'weight': weight})
-
-    return render_template('tags.html', tags=tag_cloud, year=datetime.now().year)
+    return render_template('tags.html', tags=build_tag_cloud(), year=datetime.now().year)
 
 @views_bp.route('/tags/<tag_slug>')
 def tag(tag_slug):
@@ -101,7 +112,7 @@ def tag(tag_slug):
     
     start = (page - 1) * per_page
     posts = tagged_posts[start:start+per_page]
-    return render_template('tag.html', tag=tag_slug.replace('-', ' '), posts=posts, total_posts=total_posts, year=datetime.now().year, page=page, total_pages=total_pages)
+    return cached_page(lambda: render_template('tag.html', tag=tag_slug.replace('-', ' '), posts=posts, total_posts=total_posts, year=datetime.now().year, page=page, total_pages=total_pages), page=page, total_pages=total_pages)
 
 @views_bp.route('/search')
 def search():
@@ -111,10 +122,7 @@ def search():
     results = []
     
     if query:
-        query_lower = query.lower()
-        for p in get_all_posts():
-            if query_lower in p['title'].lower() or query_lower in p['summary'].lower() or any(query_lower in t.lower() for t in p['tags']):
-                results.append(p)
+        results = find_posts(query)
     
     total_results = len(results)
     total_pages = (total_results + per_page - 1) // per_page if total_results > 0 else 1
@@ -142,51 +150,28 @@ def contact():
 def robots_txt():
     return make_response(render_template('robots.txt'), {'Content-Type': 'text/plain'})
 
+def feed_response(kind, mimetype):
+    # ?limit=N keeps only the newest N posts
+    limit = request.args.get('limit', type=int) if kind != 'sitemap' else None
+    if limit is not None and (limit < 1 or limit >= len(get_all_posts())):
+        limit = None
+    artifact = get_feed(kind, limit)
+    from flask import current_app
+    response = current_app.response_class(artifact['body'], mimetype=mimetype)
+    response.set_etag(artifact['etag'])
+    response.last_modified = artifact['last_modified']
+    response.cache_control.public = True
+    response.cache_control.max_age = 300
+    return response.make_conditional(request)
+
 @views_bp.route('/sitemap.xml')
 def sitemap():
-    posts = get_all_posts()
-    base_url = "https://blog.joshattic.us"
-    xml = '<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
-    
-    static_pages = [
-        {'loc': '/', 'changefreq': 'daily', 'priority': '1.0'},
-        {'loc': '/tags', 'changefreq': 'weekly', 'priority': '0.8'},
-        {'loc': '/search', 'changefreq': 'monthly', 'priority': '0.5'},
-        {'loc': '/privacy', 'changefreq': 'yearly', 'priority': '0.3'},
-        {'loc': '/terms', 'changefreq': 'yearly', 'priority': '0.3'},
-    ]
-    for page in static_pages:
-        xml += f'  <url>\n    <loc>{base_url}{page["loc"]}</loc>\n    <changefreq>{page["changefreq"]}</changefreq>\n    <priority>{page["priority"]}</priority>\n  </url>\n'
-    
-    for p in posts:
-        xml += f'  <url>\n    <loc>{base_url}/posts/{p["slug"]}</loc>\n    <lastmod>{p["date"]}</lastmod>\n    <changefreq>monthly</changefreq>\n    <priority>0.7</priority>\n  </url>\n'
-    xml += '</urlset>'
-    
-    response = make_response(xml)
-    response.headers["Content-Type"] = "application/xml"
-    return response
+    return feed_response('sitemap', 'application/xml')
 
 @views_bp.route('/feed.rss')
 def rss_feed():
-    fg = FeedGenerator()
-    fg.title('JoshAtticus Blog')
-    fg.description('Personal blog')
-    fg.link(href='https://blog.joshattic.us')
-    fg.language('en')
-    
-    for p in get_all_posts()[::-1]:
-        fe = fg.add_entry()
-        fe.title(p['title'])
-        fe.link(href=f"https://blog.joshattic.us/posts/{p['slug']}")
-        try:
-            fe.published(datetime.strptime(p['date'], '%Y-%m-%d').replace(tzinfo=timezone.utc))
-        except:
-            fe.published(datetime.now(timezone.utc))
-        
-        content = f'<p><img src="https://blog.joshattic.us/{p["image"]}" alt="{p["title"]}"></p>' if p['image'] else ""
-        fe.content(content + p['content'], type='html')
-        for tag in p['tags']:
-            fe.category(term=tag)
-            
-    from flask import current_app
-    return current_app.response_class(fg.rss_str(), mimetype='application/rss+xml')
+    return feed_response('rss', 'application/rss+xml')
+
+@views_bp.route('/feed.atom')
+def atom_feed():
+    return feed_response('atom', 'application/atom+xml')
@@ -0,0 +1,115 @@
+import os
+import re
+import html
+import sqlite3
+import tempfile
+import threading
+from post_index import POST_INDEX_DIR, get_compiled_posts, get_posts_version, read_post_body
+from post_helpers import get_all_posts
+
+# Full-text index over the compiled posts (title, summary, tags and body) in
+# its own SQLite FTS5 file next to the post index. It is rebuilt whenever the
+# post set version changes, so it never needs the blog database.
+SEARCH_DB_PATH = os.path.join(POST_INDEX_DIR, 'search.db')
+# bm25 column weights: slug (unindexed), title, summary, tags, body
+BM25_WEIGHTS = (0.0, 10.0, 5.0, 5.0, 1.0)
+SNIPPET_TOKENS = 24
+# Control characters can't appear in indexed text, so they make safe markers
+# that survive html.escape and are swapped for <mark> afterwards.
+_HL_START, _HL_END = '\x02', '\x03'
+
+_build_lock = threading.Lock()
+_local = threading.local()
+
+def _plain_text(html_content):
+    text = re.sub(r'<(script|style)\b.*?</\1>', ' ', html_content or '', flags=re.DOTALL | re.IGNORECASE)
+    text = re.sub(r'<[^>]+>', ' ', text)
+    text = html.unescape(text).replace(_HL_START, ' ').replace(_HL_END, ' ')
+    return re.sub(r'\s+', ' ', text).strip()
+
+def _read_version(path):
+    try:
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        try:
+            return conn.execute("SELECT value FROM search_meta WHERE key = 'version'").fetchone()[0]
+        finally:
+            conn.close()
+    except (sqlite3.Error, TypeError):
+        return None
+
+def refresh_search_index(force=False):
+    """Rebuild the FTS index if it was built from an older post set. Returns
+    True when a rebuild happened."""
+    version = get_posts_version()
+    with _build_lock:
+        if not force and _read_version(SEARCH_DB_PATH) == version:
+            return False
+
+        os.makedirs(POST_INDEX_DIR, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=POST_INDEX_DIR, suffix='.search.tmp')
+        os.close(fd)
+        try:
+            conn = sqlite3.connect(tmp)
+            conn.execute("CREATE VIRTUAL TABLE posts_fts USING fts5(slug UNINDEXED, title, summary, tags, body, tokenize='unicode61 remove_diacritics 2')")
+            conn.execute('CREATE TABLE search_meta (key TEXT PRIMARY KEY, value TEXT)')
+            conn.executemany('INSERT INTO posts_fts (slug, title, summary, tags, body) VALUES (?, ?, ?, ?, ?)', [
+                (p['slug'], p['title'], p['summary'], ' '.join(p.get('tags', [])), _plain_text(read_post_body(p['slug'])))
+                for p in get_compiled_posts()
+            ])
+            conn.execute("INSERT INTO search_meta (key, value) VALUES ('version', ?)", (version,))
+            conn.execute("INSERT INTO posts_fts (posts_fts) VALUES ('optimize')")
+            conn.commit()
+            conn.close()
+            os.replace(tmp, SEARCH_DB_PATH)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return True
+
+def _get_connection():
+    version = get_posts_version()
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.version == version and _local.pid == os.getpid():
+        return conn
+    if conn is not None:
+        conn.close()
+    refresh_search_index()
+    conn = sqlite3.connect(f'file:{SEARCH_DB_PATH}?mode=ro', uri=True)
+    _local.conn, _local.version, _local.pid = conn, version, os.getpid()
+    return conn
+
+def build_match_query(query):
+    """Turn free text into an FTS5 expression: every word must match, as a
+    prefix so search-as-you-type finds 'pix' -> 'pixel'."""
+    terms = re.findall(r'\w+', query.lower())
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def _highlight(snippet):
+    return html.escape(snippet).replace(_HL_START, '<mark>').replace(_HL_END, '</mark>')
+
+def search_posts(query, limit=100):
+    """Return [{'slug', 'snippet', 'score'}] best match first. Snippets are
+    HTML-escaped with matches wrapped in <mark>."""
+    match = build_match_query(query)
+    if not match:
+        return []
+    conn = _get_connection()
+    rows = conn.execute(f'''
+        SELECT slug, snippet(posts_fts, 4, ?, ?, '…', ?), bm25(posts_fts, {', '.join(str(w) for w in BM25_WEIGHTS)}) AS score
+        FROM posts_fts WHERE posts_fts MATCH ?
+        ORDER BY score LIMIT ?
+    ''', (_HL_START, _HL_END, SNIPPET_TOKENS, match, limit)).fetchall()
+    return [{'slug': slug, 'snippet': _highlight(snippet), 'score': score} for slug, snippet, score in rows]
+
+def find_posts(query):
+    """Post metadata for every match, best first, each with a 'snippet'."""
+    posts_map = {p['slug']: p for p in get_all_posts()}
+    try:
+        hits = search_posts(query)
+    except sqlite3.Error as e:
+        # No FTS5 in this SQLite build (or a broken index): plain substring scan
+        print(f"[search] Falling back to substring search: {e}")
+        query_lower = query.lower()
+        return [p for p in posts_map.values() if query_lower in p['title'].lower() or query_lower in p['summary'].lower() or any(query_lower in t.lower() for t in p['tags'])]
+    return [{**posts_map[hit['slug']], 'snippet': hit['snippet']} for hit in hits if hit['slug'] in posts_map]
@@ -2,7 +2,7 @@ import os
 import shutil
 import sys
 from datetime import datetime
-from flask import Flask, render_template, request
+from flask import Flask, render_template
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 NO_CACHE = '--no-cache' in sys.argv
@@ -15,18 +15,27 @@ if NO_CACHE:
 
 # Core helpers and extensions
 from db_helpers import init_db, get_current_user
+from db_pool import release_db
+from analytics_buffer import start_analytics_flush_thread
+from analytics_retention import start_analytics_retention_thread
+from ip_enrichment import start_ip_enrichment_thread
 from post_helpers import start_wasteof_sync_thread
-from extensions import oauth, is_local
+from post_index import refresh_post_index
+from search_index import refresh_search_index
+from image_variants import start_image_variant_thread
+from asset_fingerprints import asset_url
+from extensions import oauth, is_local, is_privacy_region
 
 # Blueprints
-from routes.views import views_bp
+from routes.views import views_bp, page_url
 from routes.api import api_bp
 from routes.admin import admin_bp
 from routes.auth import auth_bp
 from routes.assets import assets_bp
 from routes.honeypot import honeypot_bp
 
-app = Flask(__name__)
+# static/ is served by the assets blueprint (fingerprinted URLs, ETags)
+app = Flask(__name__, static_folder=None)
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
 
 # Session configurations
@@ -51,6 +60,14 @@ app.register_blueprint(auth_bp)
 app.register_blueprint(assets_bp)
 app.register_blueprint(honeypot_bp)
 
+# Content-hashed URLs for style.css and static/ files
+app.add_template_global(asset_url)
+app.add_template_global(page_url)
+
+# Pooled SQLite connections outlive the request; just make sure nothing is
+# left mid-transaction when it ends.
+app.teardown_appcontext(release_db)
+
 # Security headers on every response
 @app.after_request
 def set_security_headers(response):
@@ -78,13 +95,9 @@ def set_security_headers(response):
 
 @app.context_processor
 def inject_globals():
-    privacy_countries = ['AT', 'BE', 'BG', 'HR', 'CY', 'CZ', 'DK', 'EE', 'FI', 'FR', 'DE', 'GR', 'HU', 'IE', 'IT', 'LV', 'LT', 'LU', 'MT', 'NL', 'PL', 'PT', 'RO', 'SK', 'SI', 'ES', 'SE', 'GB', 'UK']
-    country = request.headers.get('CF-IPCountry', '').upper() if 'request' in globals() else ''
-    is_privacy_region = country in privacy_countries or country == 'US' or os.environ.get('FORCE_PRIVACY_BANNER') == 'true'
-    
     return {
         'year': datetime.now().year,
-        'is_privacy_region': is_privacy_region,
+        'is_privacy_region': is_privacy_region(),
         'current_user': get_current_user()
     }
 
@@ -111,7 +124,13 @@ def method_not_allowed(e):
 if os.environ.get('WERKZEUG_RUN_MAIN') != 'true':  # don't run twice in Flask debug mode reloader
     try:
         init_db()
+        refresh_post_index()
+        refresh_search_index()
         start_wasteof_sync_thread()
+        start_analytics_flush_thread()
+        start_analytics_retention_thread()
+        start_image_variant_thread()
+        start_ip_enrichment_thread()
     except Exception as e:
         print(f"Failed to initialize: {e}")
 
@@ -51,6 +51,7 @@
             <div class="post-content">
               <div class="summary">
                 ${post.summary}
+                ${post.snippet ? `<p class="search-snippet">${post.snippet}</p>` : ''}
                 ${tagsHTML}
               </div>
               <div class="post-image">
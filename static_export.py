@@ -0,0 +1,164 @@
+import os
+import re
+import sys
+import glob
+import shutil
+import sqlite3
+from datetime import datetime
+from flask import Flask, render_template, request
+from asset_fingerprints import asset_url
+from post_index import refresh_post_index
+from post_helpers import get_all_posts, get_post_by_slug, get_posts_by_tag, get_tags
+from image_variants import get_variant, iter_source_images, VARIANTS, IMAGE_EXTENSIONS
+from feeds import build_sitemap, build_rss, build_atom
+from routes.views import build_tag_cloud
+
+# Renders the public read-only surface (index and tag pages with pagination,
+# posts, tags, sitemap, feeds, robots, static files and post assets) into a
+# directory that nginx or Cloudflare Pages can serve without Python. Comments,
+# auth, search results, analytics and admin still need the Flask app.
+#
+#   python static_export.py [output_dir]
+#
+# Pages are written as <path>/index.html, pagination as <path>/page/<n>/.
+# Post images at their normal URL are the 'full' variant (what Flask serves
+# without ?size); the other sizes live under /sizes/<size>/<url>, e.g. for nginx:
+#
+#   location /posts/ { if ($arg_size) { rewrite ^ /sizes/$arg_size$uri break; } }
+#
+# View and share counts are a snapshot taken at export time. The privacy
+# banner can't depend on the visitor's country here, so it is always shown.
+EXPORT_DIR = os.environ.get('STATIC_EXPORT_DIR', 'dist')
+PER_PAGE = 12
+# URL prefixes for post assets and the directory each one maps to
+ASSET_ROUTES = [('assets', 'posts/assets'), ('posts/assets', 'posts/assets')]
+
+def static_page_url(page):
+    base = re.sub(r'/page/\d+/?$', '', request.path).rstrip('/')
+    return f'{base}/page/{page}/' if page > 1 else (base or '/')
+
+def create_export_app():
+    app = Flask(__name__, static_folder=None, root_path=os.path.dirname(os.path.abspath(__file__)))
+    app.add_template_global(asset_url)
+    app.add_template_global(static_page_url, 'page_url')
+
+    @app.context_processor
+    def inject_globals():
+        return {
+            'year': datetime.now().year,
+            'is_privacy_region': True,
+            'current_user': None
+        }
+    return app
+
+def _write(output_dir, path, data):
+    target = os.path.join(output_dir, path.lstrip('/'))
+    if path.endswith('/'):
+        target = os.path.join(target, 'index.html')
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as f:
+        f.write(data.encode('utf-8') if isinstance(data, str) else data)
+
+def _render(app, path, template, **context):
+    with app.test_request_context(path):
+        return render_template(template, **context)
+
+def _post_counts(slug):
+    from db_helpers import get_view_count, get_shares_count
+    try:
+        return get_view_count(slug), get_shares_count(slug)
+    except sqlite3.Error:
+        return 0, 0
+
+def _export_listing(app, output_dir, base, template, posts, **context):
+    total_pages = (len(posts) + PER_PAGE - 1) // PER_PAGE
+    for page in range(1, max(total_pages, 1) + 1):
+        path = base if page == 1 else f'{base}page/{page}/'
+        html = _render(app, path, template, posts=posts[(page - 1) * PER_PAGE:page * PER_PAGE], page=page, total_pages=total_pages, **context)
+        _write(output_dir, path, html)
+    return max(total_pages, 1)
+
+def export_pages(app, output_dir):
+    posts = get_all_posts()
+    year = datetime.now().year
+    count = _export_listing(app, output_dir, '/', 'index.html', posts, year=year)
+
+    for meta in posts:
+        post_item = get_post_by_slug(meta['slug'])
+        view_count, shares_count = _post_counts(meta['slug'])
+        path = f"/posts/{meta['slug']}/"
+        _write(output_dir, path, _render(app, path, 'post.html', post=post_item, year=year,
+            url=f"https://blog.joshattic.us/posts/{meta['slug']}", absolute_image_url=f"https://blog.joshattic.us/{meta['image']}",
+            view_count=view_count, shares_count=shares_count))
+        count += 1
+
+    _write(output_dir, '/tags/', _render(app, '/tags/', 'tags.html', tags=build_tag_cloud(), year=year))
+    count += 1
+    for tag in get_tags():
+        tagged = get_posts_by_tag(tag['slug'])
+        count += _export_listing(app, output_dir, f"/tags/{tag['slug']}/", 'tag.html', tagged, tag=tag['slug'].replace('-', ' '), total_posts=len(tagged), year=year)
+
+    for path, template in [('/privacy/', 'privacy.html'), ('/terms/', 'terms.html'), ('/contact/', 'contact.html'), ('/bot/', 'bot.html')]:
+        _write(output_dir, path, _render(app, path, template, year=year))
+        count += 1
+    _write(output_dir, '/search/', _render(app, '/search/', 'search.html', results=[], query='', year=year, page=1, total_pages=1, total_results=0))
+    _write(output_dir, '/404.html', _render(app, '/404.html', 'error.html', error_code=404, error_title="Page Not Found", error_description="The page you are looking for might have been removed or changed."))
+
+    _write(output_dir, '/sitemap.xml', build_sitemap(posts))
+    _write(output_dir, '/feed.rss', build_rss(posts))
+    _write(output_dir, '/feed.atom', build_atom(posts))
+    _write(output_dir, '/robots.txt', _render(app, '/robots.txt', 'robots.txt'))
+    return count + 4
+
+def _copy(source, target):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    shutil.copyfile(source, target)
+
+def export_static_files(output_dir):
+    # Plain and fingerprinted names, so both old and new URLs resolve
+    copied = 0
+    for source in ['style.css'] + [os.path.join(root, name) for root, _, files in os.walk('static') for name in files]:
+        url = '/' + source.replace(os.sep, '/')
+        for name in {url, asset_url(url)}:
+            _copy(source, os.path.join(output_dir, name.lstrip('/')))
+            copied += 1
+    return copied
+
+def export_post_assets(output_dir):
+    images = set(iter_source_images())
+    copied = 0
+    for source_dir in ['posts/assets'] + glob.glob('posts/*-assets'):
+        for root, _, files in os.walk(source_dir):
+            for name in files:
+                source = os.path.normpath(os.path.join(root, name))
+                relative = os.path.relpath(source, source_dir)
+                prefixes = [prefix for prefix, directory in ASSET_ROUTES if directory == source_dir] or [source_dir]
+                for prefix in prefixes:
+                    url_path = os.path.join(prefix, relative)
+                    if source in images and name.lower().endswith(IMAGE_EXTENSIONS):
+                        _copy(get_variant(source, 'full'), os.path.join(output_dir, url_path))
+                        _copy(source, os.path.join(output_dir, 'sizes', 'original', url_path))
+                        for variant in VARIANTS:
+                            _copy(get_variant(source, variant), os.path.join(output_dir, 'sizes', variant, url_path))
+                    else:
+                        _copy(source, os.path.join(output_dir, url_path))
+                    copied += 1
+    return copied
+
+def export_site(output_dir=EXPORT_DIR):
+    refresh_post_index()
+    if os.path.isdir(output_dir) and os.listdir(output_dir):
+        # Only ever wipe a previous export, never some other directory
+        if not os.path.exists(os.path.join(output_dir, 'sitemap.xml')):
+            raise ValueError(f'{output_dir} is not empty and is not a previous export')
+        shutil.rmtree(output_dir)
+    app = create_export_app()
+    pages = export_pages(app, output_dir)
+    static_files = export_static_files(output_dir)
+    assets = export_post_assets(output_dir)
+    return pages, static_files, assets
+
+if __name__ == '__main__':
+    output_dir = sys.argv[1] if len(sys.argv) > 1 else EXPORT_DIR
+    pages, static_files, assets = export_site(output_dir)
+    print(f"[static_export] {pages} pages, {static_files} static files and {assets} post assets written to {output_dir}/")
@@ -0,0 +1,105 @@
+import os
+import time
+import sqlite3
+import threading
+from urllib.parse import urlsplit
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from db_pool import get_db
+
+# The /wp-admin-login tarpit feeds fingerprinted scanners an endless page of
+# heavy SVG. Only the standalone asyncio server (tarpit_server.py) streams
+# it; the app redirects there when TARPIT_URL is set and otherwise answers
+# with a plain 403, since a sync gunicorn worker would be pinned for as long
+# as it streamed. A bare ':port' TARPIT_URL (the Docker image's default)
+# points at that port on whichever host the scanner requested.
+TARPIT_URL = os.environ.get('TARPIT_URL')
+TARPIT_LIMIT_BYTES = 5 * 1024 * 1024 * 1024
+# Per-IP send rate, how many streams the asyncio server runs at once, and how
+# many of those one address may hold
+TARPIT_RATE_BYTES = int(os.environ.get('TARPIT_RATE_BYTES', 512 * 1024))
+TARPIT_MAX_STREAMS = int(os.environ.get('TARPIT_MAX_STREAMS', 256))
+TARPIT_MAX_STREAMS_PER_IP = int(os.environ.get('TARPIT_MAX_STREAMS_PER_IP', 4))
+TOKEN_MAX_AGE = 60 * 60
+DATA_SENT_FLUSH_INTERVAL = 5
+CHUNK_SIZE = 64 * 1024
+
+PAGE_HEAD = b"<!DOCTYPE html><html><head><title>Admin Panel Loading...</title></head><body><h1>Loading Assets...</h1><div style='display:none;'>"
+PAGE_TAIL = b"</div></body></html>"
+
+def _build_chunks():
+    complex_path = "M 0 0 " + " ".join([f"Q {i%500} {(i*2)%500} {(i*3)%500} {(i*4)%500}" for i in range(100)])
+    svg_template = f"<svg width='500' height='500'><path d='{complex_path}' fill='none' stroke='black'/></svg>"
+    body = memoryview((svg_template * 500).encode('utf-8'))
+    # Slices share the one buffer; nothing is copied per stream
+    return [body[i:i + CHUNK_SIZE] for i in range(0, len(body), CHUNK_SIZE)]
+
+CHUNKS = _build_chunks()
+
+def iter_chunks(limit=TARPIT_LIMIT_BYTES, chunks=CHUNKS):
+    """The page body as precomputed chunks, up to limit bytes."""
+    sent = 0
+    while sent < limit:
+        for chunk in chunks:
+            yield chunk
+            sent += len(chunk)
+
+# ---------------------------------------------------------------------------
+# data_sent accounting
+# ---------------------------------------------------------------------------
+
+_lock = threading.Lock()
+_pending_bytes = {}
+_last_flush = [time.monotonic()]
+
+def record_sent(db_id, count):
+    with _lock:
+        _pending_bytes[db_id] = _pending_bytes.get(db_id, 0) + count
+
+def flush_data_sent(force=False, conn=None):
+    """Add the bytes streamed since the last flush to blocked_ips.data_sent.
+    Runs at most every DATA_SENT_FLUSH_INTERVAL seconds unless forced."""
+    now = time.monotonic()
+    with _lock:
+        if not _pending_bytes or (not force and now - _last_flush[0] < DATA_SENT_FLUSH_INTERVAL):
+            return 0
+        pending = dict(_pending_bytes)
+        _pending_bytes.clear()
+        _last_flush[0] = now
+    conn = conn or get_db()
+    try:
+        conn.executemany('UPDATE blocked_ips SET data_sent = COALESCE(data_sent, 0) + ? WHERE id = ?', [(count, db_id) for db_id, count in pending.items()])
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        with _lock:
+            for db_id, count in pending.items():
+                _pending_bytes[db_id] = _pending_bytes.get(db_id, 0) + count
+        print(f"[tarpit] Failed to record data_sent: {e}")
+        return 0
+    return sum(pending.values())
+
+# ---------------------------------------------------------------------------
+# Links to the standalone server
+# ---------------------------------------------------------------------------
+
+def _serializer():
+    return URLSafeTimedSerializer(os.environ.get('SECRET_KEY', ''), salt='tarpit')
+
+def tarpit_link(ip, db_id, host=None):
+    """Signed TARPIT_URL link for a blocked_ips row, so the server only
+    streams (and bills data_sent) for rows the app sent there. host is the
+    request's Host, used when TARPIT_URL is just ':port'."""
+    base = TARPIT_URL
+    if base.startswith(':'):
+        # The tarpit speaks plain HTTP only
+        hostname = urlsplit(f'//{host}').hostname
+        base = f"http://{f'[{hostname}]' if ':' in hostname else hostname}{base}"
+    return f"{base.rstrip('/')}/{_serializer().dumps([ip, db_id])}"
+
+def read_tarpit_token(token):
+    """(ip, db_id) from a tarpit_link token, or None if invalid or expired."""
+    try:
+        ip, db_id = _serializer().loads(token, max_age=TOKEN_MAX_AGE)
+    except (BadSignature, ValueError, TypeError):
+        return None
+    return ip, db_id
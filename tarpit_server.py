@@ -0,0 +1,116 @@
+import os
+import time
+import signal
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from tarpit import (
+    TARPIT_MAX_STREAMS, TARPIT_MAX_STREAMS_PER_IP, TARPIT_RATE_BYTES, DATA_SENT_FLUSH_INTERVAL, PAGE_HEAD, PAGE_TAIL,
+    iter_chunks, read_tarpit_token, record_sent, flush_data_sent
+)
+
+# Standalone tarpit: a single asyncio process that holds every tarpit
+# connection, so the gunicorn workers only ever answer with a redirect.
+# Run it next to the app and point TARPIT_URL at it:
+#
+#   python tarpit_server.py            (TARPIT_HOST / TARPIT_PORT)
+#   TARPIT_URL=https://tarpit.example.com gunicorn ... wsgi:app
+#
+# It needs the app's SECRET_KEY (to check links) and DB_PATH (for data_sent).
+TARPIT_HOST = os.environ.get('TARPIT_HOST', '0.0.0.0')
+TARPIT_PORT = int(os.environ.get('TARPIT_PORT', 3002))
+REQUEST_TIMEOUT = 10
+
+RESPONSE_HEADERS = (
+    b'HTTP/1.1 200 OK\r\n'
+    b'Content-Type: text/html\r\n'
+    b'Cache-Control: no-store\r\n'
+    b'Connection: close\r\n\r\n'
+)
+FORBIDDEN = b'HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+BUSY = b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+
+_streams = {'active': 0}
+_ip_streams = {}
+# ip -> monotonic time its next byte may be sent; shared by all of an IP's
+# connections so opening more of them doesn't raise its rate
+_next_send = {}
+# One thread, so all data_sent writes share one SQLite connection
+_db_executor = ThreadPoolExecutor(max_workers=1)
+
+async def _stream(writer, ip, db_id):
+    writer.write(RESPONSE_HEADERS + PAGE_HEAD)
+    await writer.drain()
+    for chunk in iter_chunks():
+        now = time.monotonic()
+        ready_at = max(_next_send.get(ip, now), now)
+        _next_send[ip] = ready_at + len(chunk) / TARPIT_RATE_BYTES
+        if ready_at > now:
+            await asyncio.sleep(ready_at - now)
+        writer.write(chunk)
+        await writer.drain()
+        record_sent(db_id, len(chunk))
+    writer.write(PAGE_TAIL)
+    await writer.drain()
+
+async def handle_connection(reader, writer):
+    try:
+        request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), REQUEST_TIMEOUT)
+        parts = request.split(b'\r\n', 1)[0].split()
+        token = parts[1].decode('ascii', 'replace').rstrip('/').rsplit('/', 1)[-1] if len(parts) > 1 else ''
+        target = read_tarpit_token(token)
+        if target is None:
+            writer.write(FORBIDDEN)
+        elif _streams['active'] >= TARPIT_MAX_STREAMS or _ip_streams.get(target[0], 0) >= TARPIT_MAX_STREAMS_PER_IP:
+            # One address can't take every slot by opening more connections
+            writer.write(BUSY)
+        else:
+            ip, db_id = target
+            _streams['active'] += 1
+            _ip_streams[ip] = _ip_streams.get(ip, 0) + 1
+            try:
+                await _stream(writer, ip, db_id)
+            finally:
+                _streams['active'] -= 1
+                _ip_streams[ip] -= 1
+                if not _ip_streams[ip]:
+                    del _ip_streams[ip]
+                    _next_send.pop(ip, None)
+        await writer.drain()
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def flush_loop():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(DATA_SENT_FLUSH_INTERVAL)
+        try:
+            await loop.run_in_executor(_db_executor, flush_data_sent)
+        except Exception as e:
+            print(f"[tarpit] Flush error: {e}")
+
+async def main():
+    server = await asyncio.start_server(handle_connection, TARPIT_HOST, TARPIT_PORT)
+    print(f"[tarpit] Listening on {TARPIT_HOST}:{TARPIT_PORT} (max {TARPIT_MAX_STREAMS} streams, {TARPIT_RATE_BYTES} B/s per IP)")
+    flusher = asyncio.create_task(flush_loop())
+    serving = asyncio.ensure_future(server.serve_forever())
+    try:
+        # Stop cleanly on SIGTERM so the last data_sent counts are written
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, serving.cancel)
+    except NotImplementedError:
+        pass
+    try:
+        await serving
+    except asyncio.CancelledError:
+        pass
+    finally:
+        server.close()
+        flusher.cancel()
+        await asyncio.get_running_loop().run_in_executor(_db_executor, lambda: flush_data_sent(force=True))
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass